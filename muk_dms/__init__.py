@@ -19,5 +19,7 @@
 #
 ###################################################################################
 
+import tools
+import fields
 import controllers
 import models
\ No newline at end of file
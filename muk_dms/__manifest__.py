@@ -25,7 +25,7 @@
     "description": """ 
         
     """,
-    "version": '10.0.1.2.0',   
+    "version": '10.0.1.3.0',   
     "category": 'Document Management',   
     "license": "AGPL-3",
     "website": "http://www.mukit.at",
@@ -43,6 +43,7 @@
         "security/dms_security.xml",
         "security/ir.model.access.csv",
         "template/assets.xml",
+        "data/dms_cron.xml",
         "views/dms_menu.xml",
         "views/dms_actions.xml",
         "views/dms_settings_view.xml",
@@ -50,6 +51,7 @@
         "views/dms_file_view.xml",
         "views/dms_data_view.xml",
         "views/dms_lock_view.xml",
+        "views/dms_index_view.xml",
     ],
     "demo": [
     ],
@@ -19,21 +19,42 @@
 #
 ###################################################################################
 
+import json
 import base64
+import hashlib
 import logging
 
 import werkzeug.utils
 import werkzeug.wrappers
+import werkzeug.exceptions
+import werkzeug.http
+
+import odoo
 
 from odoo import _
+from odoo import api
 from odoo import tools
 from odoo import http
+from odoo import SUPERUSER_ID
 from odoo.http import request
 from odoo.http import Response
-from odoo.exceptions import AccessError
+from odoo.exceptions import AccessError, ValidationError
+
+from odoo.addons.muk_dms.models import dms_base
+from odoo.addons.muk_dms.models import dms_rendition
+from odoo.addons.muk_dms.models.dms_upload import UploadOffsetError
 
 _logger = logging.getLogger(__name__)
 
+def _stream_content(dbname, model, id, start, end):
+    """Yields the requested bytes of a data object. The response is streamed after
+    the request has been finished, therefore the content is read with its own cursor."""
+    with api.Environment.manage():
+        with odoo.registry(dbname).cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            for chunk in env[model].browse(id)._iter_content(start, end):
+                yield chunk
+
 class DocumentController(http.Controller):
 
     @http.route(['/dms/checkout/',
@@ -42,26 +63,107 @@ class DocumentController(http.Controller):
         '/dms/checkout/<int:id>-<string:unique>',
         '/dms/checkout/<int:id>-<string:unique>/<string:filename>'], type='http', auth="user")
     def checkout(self, id=None, filename=None, unique=None, data=None, token=None):
-        status, headers, content = request.registry['ir.http'].binary_content(
-            model='muk_dms.file', id=id, field='content', unique=unique,
-            filename=filename, filename_field='name', download=True)
-        if status == 304:
-            response = werkzeug.wrappers.Response(status=status, headers=headers)
-        elif status == 301:
-            return werkzeug.utils.redirect(content, code=301)
-        elif status == 301:
-            return werkzeug.utils.redirect(content, code=301)
-        elif status != 200:
-            response = request.not_found()
+        file = request.env['muk_dms.file'].browse(id)
+        if not id or not file.exists() or not file.check_access('read'):
+            return request.not_found()
+        reference = file.sudo().reference
+        etag = '"%s"' % (reference and reference.checksum or 
+            hashlib.md5("%s-%s" % (file.id, file.write_date)).hexdigest())
+        headers = [
+            ('Content-Type', file.mimetype or 'application/octet-stream'),
+            ('Content-Disposition', http.content_disposition(filename or file.name)),
+            ('Accept-Ranges', 'bytes'),
+            ('ETag', etag),
+            ('Cache-Control', 'max-age=%s' % (http.STATIC_CACHE if unique else 0))]
+        byte_range = request.httprequest.range
+        if request.httprequest.headers.get('If-None-Match') == etag:
+            response = werkzeug.wrappers.Response(status=304, headers=headers)
         else:
-            content_base64 = base64.b64decode(content)
-            headers.append(('Content-Length', len(content_base64)))
-            response = request.make_response(content_base64, headers)
+            length = reference._content_length() if reference else 0
+            if byte_range:
+                bounds = byte_range.range_for_length(length)
+                if not bounds:
+                    return werkzeug.wrappers.Response(status=416, headers=[
+                        ('Content-Range', 'bytes */%s' % length)])
+                start, end = bounds
+                headers.append(('Content-Range', 'bytes %s-%s/%s' % (start, end - 1, length)))
+            else:
+                start, end = 0, length
+            headers.append(('Content-Length', str(end - start)))
+            content = _stream_content(request.db, reference._name, reference.id, start, end) if reference else []
+            response = werkzeug.wrappers.Response(content, status=206 if byte_range else 200,
+                headers=headers, direct_passthrough=True)
         if token:
             response.set_cookie('fileToken', token)
+        if not byte_range:
+            # partial requests are issued by viewers seeking in an already checked out file
+            try:
+                lock = request.env['muk_dms.file'].sudo().browse(id).user_lock()[0]
+                response.set_cookie('checkoutToken', lock['token'])
+            except AccessError:
+                response = werkzeug.exceptions.Forbidden()
+        return response
+    
+    @http.route(['/dms/thumbnail/<int:id>',
+        '/dms/thumbnail/<int:id>/<int:size>'], type='http', auth="user")
+    def thumbnail(self, id, size=None, unique=None, **kw):
+        file = request.env['muk_dms.file'].browse(id)
+        if not file.exists() or not file.check_access('read'):
+            return request.not_found()
+        rendition = file._get_rendition(size or dms_rendition.THUMBNAIL_SIZE)
+        if not rendition:
+            return werkzeug.utils.redirect(dms_base.icon_url(dms_base.icon_name(file.extension or "")))
+        etag = '"%s-%s"' % (rendition.checksum, rendition.size)
+        headers = [
+            ('Content-Type', rendition.mimetype or 'image/png'),
+            ('ETag', etag),
+            ('Cache-Control', 'max-age=%s' % (http.STATIC_CACHE if unique else 0))]
+        if request.httprequest.headers.get('If-None-Match') == etag:
+            return werkzeug.wrappers.Response(status=304, headers=headers)
+        content = base64.b64decode(rendition.data)
+        headers.append(('Content-Length', str(len(content))))
+        return werkzeug.wrappers.Response(content, headers=headers)
+    
+    @http.route('/dms/upload', type='json', auth="user")
+    def upload_start(self, directory, name, size, **kw):
+        upload = request.env['muk_dms.upload']._start(int(directory), name, int(size))
+        return {'token': upload.token, 'offset': 0}
+    
+    @http.route('/dms/upload/<string:token>', type='http', auth="user", methods=['GET'])
+    def upload_status(self, token, **kw):
+        upload = request.env['muk_dms.upload']._find(token)
+        if not upload:
+            return request.not_found()
+        return self._upload_response(upload)
+    
+    @http.route('/dms/upload/<string:token>', type='http', auth="user", methods=['PUT', 'POST'], csrf=False)
+    def upload_chunk(self, token, offset=None, **kw):
+        upload = request.env['muk_dms.upload']._find(token)
+        if not upload:
+            return request.not_found()
+        if offset is None:
+            content_range = werkzeug.http.parse_content_range_header(
+                request.httprequest.headers.get('Content-Range'))
+            offset = content_range.start if content_range else 0
         try:
-            lock = request.env['muk_dms.file'].sudo().browse(id).user_lock()[0]
-            response.set_cookie('checkoutToken', lock['token'])
-        except AccessError:
-            response = werkzeug.exceptions.Forbidden()
-        return response
\ No newline at end of file
+            upload._append(int(offset), request.httprequest.stream)
+        except UploadOffsetError:
+            # the transaction is rolled back, the client resumes from the received offset
+            request.env.cr.rollback()
+            return self._upload_response(upload, status=409)
+        except (ValidationError, AccessError) as error:
+            # the upload can't be completed, so it is removed instead of being resumed
+            request.env.cr.rollback()
+            upload.unlink()
+            return Response(json.dumps({'error': error.name}), 
+                status=403 if isinstance(error, AccessError) else 400, 
+                headers=[('Content-Type', 'application/json')])
+        return self._upload_response(upload)
+    
+    def _upload_response(self, upload, status=200):
+        upload.invalidate_cache()
+        return Response(json.dumps({
+                'offset': upload.received,
+                'size': upload.size,
+                'file': upload.file.id or None}), 
+            status=status, headers=[('Content-Type', 'application/json')])
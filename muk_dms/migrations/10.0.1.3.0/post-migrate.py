@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+
+from odoo import api, SUPERUSER_ID
+
+def migrate(cr, version):
+    if not version:
+        return
+    
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env["muk_dms.directory"]._reconcile_size()
+    
+    # rewrites the content without line breaks, which also stores it uncompressed
+    cr.execute("""
+        UPDATE muk_dms_data_database 
+        SET data = decode(translate(encode(data, 'escape'), E'\\r\\n', ''), 'escape')
+        WHERE data IS NOT NULL
+    """)
+    
+    cr.execute("""
+        UPDATE muk_dms_lock 
+        SET expiry = (now() at time zone 'UTC') + %s * interval '1 second'
+        WHERE expiry IS NULL
+    """, (env["muk_dms.lock"]._lease(env.user),))
+    
+    cr.execute("""
+        UPDATE muk_dms_file SET thumbnail_state = 'pending'
+        WHERE mimetype LIKE 'image/%' OR mimetype = 'application/pdf'
+    """)
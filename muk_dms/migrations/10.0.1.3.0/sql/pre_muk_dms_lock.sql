@@ -0,0 +1,6 @@
+DELETE FROM muk_dms_lock WHERE operation IS NOT NULL;
+ALTER TABLE muk_dms_lock ADD COLUMN res_model character varying;
+ALTER TABLE muk_dms_lock ADD COLUMN res_id integer;
+UPDATE muk_dms_lock SET res_model = split_part(lock_ref, ',', 1), res_id = split_part(lock_ref, ',', 2)::integer;
+DELETE FROM muk_dms_lock a USING muk_dms_lock b WHERE a.res_model = b.res_model AND a.res_id = b.res_id AND a.id > b.id;
+ALTER TABLE muk_dms_lock DROP COLUMN lock_ref;
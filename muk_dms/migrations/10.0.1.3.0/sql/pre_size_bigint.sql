@@ -0,0 +1,2 @@
+ALTER TABLE muk_dms_directory ALTER COLUMN size TYPE bigint;
+ALTER TABLE muk_dms_file ALTER COLUMN size TYPE bigint;
@@ -25,3 +25,7 @@ from . import dms_directory
 from . import dms_file
 from . import dms_data
 from . import dms_lock
+from . import dms_upload
+from . import dms_rendition
+from . import dms_index
+from . import ir_autovacuum
@@ -20,19 +20,74 @@
 ###################################################################################
 
 import os
+import re
 import string
-import shutil
+import base64
 import hashlib
 import logging
-import tempfile
 import unicodedata
 
+import psycopg2
+
+import odoo
+
 from odoo import _
+from odoo import SUPERUSER_ID
 from odoo import models, api, fields
+from odoo.osv import expression
 from odoo.exceptions import ValidationError, AccessError, UserError
 
 _logger = logging.getLogger(__name__)
 
+_img_path = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static/src/img'))
+_img_url = '/muk_dms/static/src/img'
+
+_icons = {}
+
+REFRESH_LIMIT = 1000
+
+def icon_name(extension=None):
+    """Returns the name of the icon for the given file extension or, without an
+    extension, the folder icon. The available icons are listed once per process."""
+    if 'names' not in _icons:
+        _icons['names'] = frozenset(os.listdir(_img_path))
+    if extension is None:
+        return "folder.png"
+    name = "file_%s.png" % extension.strip(".")
+    return name if name in _icons['names'] else "file_unkown.png"
+
+def icon_content(name):
+    """Returns the base64 encoded icon, which is read once per process."""
+    if name not in _icons:
+        with open(os.path.join(_img_path, name), "rb") as image_file:
+            _icons[name] = base64.b64encode(image_file.read())
+    return _icons[name]
+
+def icon_url(name):
+    return "%s/%s" % (_img_url, name)
+
+def _discard_refresh(cr):
+    cr._dms_refresh = None
+
+def _send_refresh(cr):
+    """Sends the refresh notifications collected during the transaction. The bus 
+    messages are stored in their own transaction, since the cursor has already
+    been committed."""
+    pending = cr._dms_refresh
+    cr._dms_refresh = None
+    if not pending:
+        return
+    channel = "%s_refresh" % cr.dbname
+    notifications = [(channel, {'model': model, 'ids': sorted(ids) if ids else None})
+        for model, ids in pending.items()]
+    try:
+        with api.Environment.manage():
+            with odoo.registry(cr.dbname).cursor() as bus_cr:
+                env = api.Environment(bus_cr, SUPERUSER_ID, {})
+                env['bus.bus'].sendmany(notifications)
+    except Exception:
+        _logger.exception("Failed to send the refresh notifications.")
+
 class DMSBaseModel(models.BaseModel):
     """Main super-class for file models.
     
@@ -49,6 +104,8 @@ class DMSBaseModel(models.BaseModel):
     _name = None     
     _description = None
     
+    _trigram_fields = []
+    
     #----------------------------------------------------------
     # Function
     #----------------------------------------------------------
@@ -68,17 +125,35 @@ class DMSBaseModel(models.BaseModel):
             self.refresh()
          
     def check_name(self, name):
-        tmp_dir = tempfile.mkdtemp()
-        try:
-            open(os.path.join(tmp_dir, name), 'a').close()
-        except IOError:
+        if not name or name in ('.', '..'):
+            return False
+        if '/' in name or '\0' in name:
+            return False
+        if len(name.encode('utf-8') if isinstance(name, unicode) else name) > 255:
             return False
-        finally:
-            shutil.rmtree(tmp_dir)
         return True
     
     def refresh(self):
-        self.env['bus.bus'].sendone("%s_refresh" % self.env.cr.dbname, self._name)
+        """Schedules a refresh notification for the records. The notifications
+        are collected per transaction and sent once per model after the commit.
+        Called on an empty recordset the views of the whole model are refreshed."""
+        cr = self.env.cr
+        pending = getattr(cr, '_dms_refresh', None)
+        if pending is None:
+            pending = cr._dms_refresh = {}
+            cr.after('commit', lambda: _send_refresh(cr))
+            cr.after('rollback', lambda: _discard_refresh(cr))
+        ids = pending.setdefault(self._name, set())
+        if ids is not None and self.ids and len(ids) < REFRESH_LIMIT:
+            ids.update(self.ids)
+        else:
+            pending[self._name] = None
+    
+    def _thumbnail_url(self, field='custom_thumbnail'):
+        """Returns the URL of the given image field, which contains the last update
+        so that the image can be cached by the browser."""
+        unique = re.sub('[^0-9]', '', self.write_date or "")
+        return "/web/image/%s/%s/%s?unique=%s" % (self._name, self.id, field, unique)
     
     def generate_key(self):
         return hashlib.sha1(os.urandom(128)).hexdigest()
@@ -100,6 +175,69 @@ class DMSBaseModel(models.BaseModel):
                 name = compute_name(name, suffix, escape_suffix)
             return name
     
+    def _unique_name(self, name, siblings, escape_suffix=False):
+        """Returns the given name or, if it is already taken, the name with the next
+        free "name(n)" suffix, using a single query on the indexed sibling names.
+        
+        :param siblings: dictionary of column values which select the siblings
+        """
+        base, extension = os.path.splitext(name) if escape_suffix else (name, "")
+        def escape_like(value):
+            return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where = " AND ".join('"%s" = %%(%s)s' % (column, column) for column in siblings)
+        params = dict(siblings)
+        params.update({
+            'name': name,
+            'like': "%s(%%)%s" % (escape_like(base), escape_like(extension)),
+            'start': len(base) + 2,
+            'length': len(base) + len(extension) + 2})
+        self.env.cr.execute("""
+            SELECT bool_or(name = %%(name)s), MAX(CASE 
+                WHEN substr(name, %%(start)s, greatest(length(name) - %%(length)s, 0)) ~ '^[0-9]{1,18}$'
+                THEN substr(name, %%(start)s, greatest(length(name) - %%(length)s, 0))::bigint END)
+            FROM "%s" WHERE %s AND (name = %%(name)s OR name LIKE %%(like)s)
+        """ % (self._table, where), params)
+        exists, suffix = self.env.cr.fetchone()
+        if not exists:
+            return name
+        return "%s(%s)%s" % (base, (suffix or 0) + 1, extension)
+    
+    def _copy_rows(self, table, values, params=None):
+        """Copies the rows listed in the given table (old_id, new_id) with a single
+        statement and duplicates their many2many relations.
+        
+        :param values: dictionary of SQL expressions for the columns, which should
+            not be copied as they are. The expressions can refer to the original
+            row as "source" and to the row of the given table as "copy".
+        :param params: dictionary of parameters for the expressions
+        """
+        values = dict(values, id="copy.new_id")
+        if self._log_access:
+            values.update({
+                'create_uid': "%(uid)s", 'create_date': "(now() at time zone 'UTC')",
+                'write_uid': "%(uid)s", 'write_date': "(now() at time zone 'UTC')"})
+        for name, field in self._fields.items():
+            if field.store and field.column_type and name not in values:
+                values[name] = 'source."%s"' % name
+        columns = list(values.keys())
+        self.env.cr.execute("""
+            INSERT INTO "{model}" ({columns})
+            SELECT {values} FROM "{model}" source
+            JOIN {table} copy ON copy.old_id = source.id
+        """.format(
+            model=self._table, table=table,
+            columns=", ".join('"%s"' % name for name in columns),
+            values=", ".join(values[name] for name in columns)),
+            dict(params or {}, uid=self.env.uid))
+        for field in self._fields.values():
+            if field.type == 'many2many' and field.store and field.copy and not field.compute:
+                self.env.cr.execute("""
+                    INSERT INTO "{relation}" ("{column1}", "{column2}")
+                    SELECT copy.new_id, rel."{column2}" FROM "{relation}" rel
+                    JOIN {table} copy ON copy.old_id = rel."{column1}"
+                """.format(relation=field.relation, column1=field.column1,
+                           column2=field.column2, table=table))
+    
     #----------------------------------------------------------
     # Read
     #----------------------------------------------------------
@@ -141,7 +279,10 @@ class DMSBaseModel(models.BaseModel):
     @api.model
     def name_search(self, name='', args=None, operator='ilike', limit=100):
         name, args, operator, limit = self._before_name_search(name, args, operator, limit)
-        result = super(DMSBaseModel, self).name_search(name, args, operator, limit)
+        if self._trigram_fields and name and operator == 'ilike':
+            result = self.quick_open(name, args, limit).name_get()
+        else:
+            result = super(DMSBaseModel, self).name_search(name, args, operator, limit)
         result = self._after_name_search(result)
         return result
     
@@ -151,44 +292,76 @@ class DMSBaseModel(models.BaseModel):
     def _after_name_search(self, result):
         return result
     
+    def _access_domain(self, operation='read', uid=None):
+        """Returns the domain restricting a search to the records the user
+        is allowed to access, so that it is applied by the database."""
+        return []
+    
+    @api.model
+    def quick_open(self, query, domain=None, limit=20):
+        """Returns the records whose name or path contains or resembles the query,
+        best matches first. Matching and ranking is done by trigram indexes."""
+        if not self._trigram_fields or not query:
+            return self.browse()
+        where_query = self._where_calc((domain or []) + self._access_domain('read'))
+        self._apply_ir_rules(where_query, 'read')
+        from_clause, where_clause, where_params = where_query.get_sql()
+        columns = ['"%s"."%s"' % (self._table, field) for field in self._trigram_fields]
+        pattern = "%%%s%%" % re.sub(r'([\\%_])', r'\\\1', query)
+        if self._trigram_available():
+            match = " OR ".join("%s ILIKE %%s OR %s %%%% %%s" % (column, column) for column in columns)
+            match_params = [pattern, query] * len(columns)
+            rank = "GREATEST(%s)" % ", ".join("similarity(%s, %%s)" % column for column in columns)
+            rank_params = [query] * len(columns)
+        else:
+            match = " OR ".join("%s ILIKE %%s" % column for column in columns)
+            match_params = [pattern] * len(columns)
+            rank, rank_params = "0", []
+        self.env.cr.execute("""
+            SELECT "{table}".id FROM {tables}
+            WHERE ({match}) {where}
+            ORDER BY {rank} DESC, length({column}), "{table}".id
+            LIMIT %s
+        """.format(table=self._table, tables=from_clause, match=match, rank=rank, 
+            column=columns[0], where=where_clause and "AND %s" % where_clause or ""), 
+            match_params + where_params + rank_params + [limit])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+    
+    def _trigram_available(self):
+        self.env.cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return bool(self.env.cr.fetchone())
+    
+    @api.model_cr_context
+    def _auto_init(self):
+        result = super(DMSBaseModel, self)._auto_init()
+        if self._trigram_fields:
+            try:
+                with self._cr.savepoint():
+                    self._cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            except psycopg2.Error:
+                _logger.warning("Unable to install the pg_trgm extension, the search of %s isn't indexed.", self._name)
+                return result
+            for field in self._trigram_fields:
+                index = "%s_%s_trgm_idx" % (self._table, field)
+                self._cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', (index,))
+                if not self._cr.fetchone():
+                    self._cr.execute('CREATE INDEX "%s" ON "%s" USING gin ("%s" gin_trgm_ops)' % (index, self._table, field))
+        return result
+    
     #----------------------------------------------------------
     # Locking
     #----------------------------------------------------------
 
     @api.multi
     def lock(self, user=None, refresh=False, operation=None):
-        result = []
-        for record in self:
-            lock = record.is_locked()
-            if lock and lock.operation and lock.operation == operation:
-                result.append({
-                    'record': record, 
-                    'lock': lock, 
-                    'token': lock.token})
-            elif lock and ((lock.operation and lock.operation != operation) or not lock.operation):
-                raise AccessError(_("The record is locked, so it can't be locked again."))
-            else:
-                token = hashlib.sha1(os.urandom(128)).hexdigest()
-                lock = self.env['muk_dms.lock'].sudo().create({
-                    'locked_by': user and user.name or "System",
-                    'locked_by_ref': user and user._name + ',' + str(user.id) or None,
-                    'lock_ref': record._name + ',' + str(record.id),
-                    'token': token,
-                    'operation': operation})
-                result.append({
-                    'record': record, 
-                    'lock': lock, 
-                    'token': token})
+        result = self.env['muk_dms.lock'].sudo()._lock_records(self, user=user, operation=operation)
         if refresh:
             self.refresh()
         return result
     
     @api.multi
     def unlock(self, refresh=False):
-        for record in self:
-            locks = self.env['muk_dms.lock'].sudo().search([('lock_ref', '=', record._name + ',' + str(record.id))])
-            for lock in locks: 
-                lock.sudo().unlink()
+        self.env['muk_dms.lock'].sudo()._unlock_records(self)
         if refresh:
             self.refresh()
         return True
@@ -196,31 +369,46 @@ class DMSBaseModel(models.BaseModel):
     @api.multi
     def is_locked(self):
         self.ensure_one()
-        lock = self.env['muk_dms.lock'].sudo().search([('lock_ref', '=', self._name + ',' + str(self.id))], limit=1)
-        if lock.id:
+        lock = self.env['muk_dms.lock'].sudo()._fetch_locks(self).get(self.id)
+        if lock:
             return lock
         return False
     
     @api.multi
     def is_locked_by(self):
         self.ensure_one()
-        lock = self.env['muk_dms.lock'].sudo().search([('lock_ref', '=', self._name + ',' + str(self.id))], limit=1)
-        if lock.id:
+        lock = self.is_locked()
+        if lock:
             return lock.locked_by_ref
         return False
     
     def _checking_lock(self, operation=None):
-        self._checking_lock_user()
-        for record in self:
-            lock = record.is_locked()
-            if lock and lock.operation and lock.operation != operation:
+        for lock in self.env['muk_dms.lock'].sudo()._fetch_locks(self).values():
+            if lock.locked_by_ref and not lock.locked_by_ref != self.env.user:
+                raise AccessError(_("The record is locked by a user, so it can't be changes or deleted."))
+            if lock.operation and lock.operation != operation:
                 raise AccessError(_("The record is locked, so it can't be changes or deleted."))
+        self._checking_advisory_lock()
             
     def _checking_lock_user(self):
-        for record in self:
-            lock = record.is_locked()
-            if lock and lock.locked_by_ref and not lock.locked_by_ref != self.env.user:
+        for lock in self.env['muk_dms.lock'].sudo()._fetch_locks(self).values():
+            if lock.locked_by_ref and not lock.locked_by_ref != self.env.user:
                 raise AccessError(_("The record is locked by a user, so it can't be changes or deleted."))
+        self._checking_advisory_lock()
+    
+    def _checking_advisory_lock(self):
+        """System locks in advisory mode don't create lock records. Instead the
+        directories containing the records are locked shared, which fails while
+        another transaction holds an exclusive tree lock on one of them."""
+        directories = self._lock_directories()
+        if directories:
+            directories = directories.sudo().filtered(
+                lambda directory: directory.settings.system_locks_mode == 'advisory')
+            self.env['muk_dms.lock'].sudo()._advisory_check(directories)
+    
+    def _lock_directories(self):
+        """Returns the directories whose trees contain the records."""
+        return None
     
     def user_lock(self):
         self.ensure_one()
@@ -253,6 +441,7 @@ class DMSBaseModel(models.BaseModel):
         vals = self._before_create(vals)
         result = super(DMSBaseModel, self).create(vals)
         result = result._after_create(vals)
+        self._invalidate_permissions()
         return result
     
     def _before_create(self, vals):
@@ -269,6 +458,7 @@ class DMSBaseModel(models.BaseModel):
         for record in self:
             record._after_write_record(vals, operation)
         result = self._after_write(result, vals, operation)
+        self._invalidate_permissions()
         return result
     
     def _before_write(self, vals, operation):
@@ -291,6 +481,7 @@ class DMSBaseModel(models.BaseModel):
             record._before_unlink_record()
         result = super(DMSBaseModel, self).unlink()
         self._after_unlink(result)
+        self._invalidate_permissions()
         return result
     
     def _before_unlink(self):
@@ -303,6 +494,17 @@ class DMSBaseModel(models.BaseModel):
     def _after_unlink(self, result):
         pass
 
+    @api.model
+    def invalidate_cache(self, fnames=None, ids=None):
+        if fnames is None:
+            self._invalidate_permissions()
+        return super(DMSBaseModel, self).invalidate_cache(fnames, ids)
+    
+    def _invalidate_permissions(self):
+        """Drops the memoised permissions of all environments."""
+        for env in list(self.env.all):
+            env.__dict__.pop('_dms_permissions', None)
+
 DMSAbstractModel = DMSBaseModel
 
 class DMSModel(DMSBaseModel):
@@ -331,19 +533,19 @@ class DMSAccessModel(DMSAbstractModel):
     #----------------------------------------------------------
             
     perm_create = fields.Boolean(
-        compute='_compute_perm_create',
+        compute='_compute_permissions',
         string="Create")
     
     perm_read = fields.Boolean(
-        compute='_compute_perm_read',
+        compute='_compute_permissions',
         string="Read")
     
     perm_write = fields.Boolean(
-        compute='_compute_perm_write',
+        compute='_compute_permissions',
         string="Write")
     
     perm_unlink = fields.Boolean(
-        compute='_compute_perm_unlink', 
+        compute='_compute_permissions', 
         string="Delete")
         
     locked = fields.Many2one(
@@ -353,7 +555,7 @@ class DMSAccessModel(DMSAbstractModel):
         prefetch=False)
     
     editor = fields.Boolean(
-        compute='_compute_editor', 
+        compute='_compute_lock', 
         string="Editor", 
         prefetch=False)
         
@@ -394,6 +596,24 @@ class DMSAccessModel(DMSAbstractModel):
         """
         return super(DMSAccessModel, self).check_field_access_rights(operation, fields)
     
+    def _eval_permissions(self, operations=('create', 'read', 'write', 'unlink')):
+        """Returns the ids of the records for which the operations are allowed, 
+        evaluated for the whole recordset at once."""
+        result = {}
+        for operation in operations:
+            if not self.ids or not self.check_access_rights(operation, raise_exception=False):
+                result[operation] = set()
+            elif self.env.uid == SUPERUSER_ID:
+                result[operation] = set(self.ids)
+            else:
+                domain = self.env['ir.rule']._compute_domain(self._name, operation)
+                if domain:
+                    domain = expression.AND([[('id', 'in', self.ids)], domain])
+                    result[operation] = set(self.sudo()._search(domain))
+                else:
+                    result[operation] = set(self.ids)
+        return result
+    
     def check_access(self, operation, raise_exception=False):
         access_right = self.check_access_rights(operation, raise_exception=False)
         access_rule = self.check_access_rule(operation=operation) == None
@@ -406,41 +626,35 @@ class DMSAccessModel(DMSAbstractModel):
     # Read, View 
     #----------------------------------------------------------
         
-    @api.one
-    def _compute_perm_create(self):
-        try:
-            self.perm_create = self.check_access('create')
-        except AccessError:
-             self.perm_create = False
-            
-    @api.one
-    def _compute_perm_read(self):
-        try:
-            self.perm_read = self.check_access('read')
-        except AccessError:
-             self.perm_create = False
-    
-    @api.one
-    def _compute_perm_write(self):
-        try:
-            self.perm_write = self.check_access('write')
-        except AccessError:
-             self.perm_create = False
-        
-    @api.one
-    def _compute_perm_unlink(self):
-        try:
-            self.perm_unlink = self.check_access('unlink')
-        except AccessError:
-             self.perm_create = False
+    def _permissions(self):
+        """Returns the result of _eval_permissions, which is memoised per environment
+        and record until a document record is created, changed or deleted."""
+        memo = getattr(self.env, '_dms_permissions', None)
+        if memo is None:
+            memo = self.env._dms_permissions = {}
+        memo = memo.setdefault(self._name, {})
+        missing = self.browse([id for id in self.ids if id not in memo])
+        if missing or not self.ids:
+            permissions = missing._eval_permissions()
+            for id in missing.ids:
+                memo[id] = dict((operation, id in ids) for operation, ids in permissions.items())
+            if not self.ids:
+                return permissions
+        operations = memo[self.ids[0]].keys()
+        return dict((operation, set(id for id in self.ids if memo[id][operation])) for operation in operations)
+    
+    def _compute_permissions(self):
+        permissions = self._permissions()
+        for record in self:
+            for operation, ids in permissions.items():
+                record['perm_%s' % operation] = record.id in ids
              
-    @api.one
     def _compute_lock(self):
-        self.locked = self.is_locked()
-      
-    @api.one  
-    def _compute_editor(self):
-        self.editor = self.is_locked_by() == self.env.user
+        locks = self.env['muk_dms.lock'].sudo()._fetch_locks(self)
+        for record in self:
+            lock = locks.get(record.id)
+            record.locked = lock or False
+            record.editor = bool(lock and lock.locked_by_ref == self.env.user)
     
     #----------------------------------------------------------
     # Create, Update, Delete
@@ -451,11 +665,9 @@ class DMSAccessModel(DMSAbstractModel):
         return super(DMSAccessModel, self)._before_create(vals)
         
     def _before_write(self, vals, operation):
-        for record in self:
-            record.check_access('write', raise_exception=True)
+        self.check_access('write', raise_exception=True)
         return super(DMSAccessModel, self)._before_write(vals, operation)
     
     def _before_unlink(self):
-        for record in self:
-            record.check_access('unlink', raise_exception=True)
+        self.check_access('unlink', raise_exception=True)
         return super(DMSAccessModel, self)._before_unlink()
\ No newline at end of file
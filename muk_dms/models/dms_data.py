@@ -19,8 +19,12 @@
 #
 ###################################################################################
 
+import io
 import abc
+import base64
+import hashlib
 import logging
+import psycopg2
 
 from odoo import _
 from odoo import models, api, fields
@@ -28,10 +32,67 @@ from odoo.exceptions import ValidationError, AccessError
 
 _logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 64 * 1024
+
+class DatabaseStream(io.RawIOBase):
+    """Seekable reader on the content of a database data object, which only
+    loads the requested parts of the base64 encoded column."""
+    
+    def __init__(self, record):
+        super(DatabaseStream, self).__init__()
+        self._record = record
+        self._length = record._content_length()
+        self._position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._position = max(offset, 0)
+        return self._position
+    
+    def readinto(self, buffer):
+        size = min(len(buffer), self._length - self._position)
+        if size <= 0:
+            return 0
+        data = self._record._read_content(self._position, size)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
 class DataModel(models.AbstractModel):
     _name = 'muk_dms.data'
     _description = 'Base Data Model'
     
+    #----------------------------------------------------------
+    # Database
+    #----------------------------------------------------------
+    
+    checksum = fields.Char(
+        string="Checksum",
+        readonly=True,
+        index=True)
+    
+    reference_count = fields.Integer(
+        string="References",
+        default=1,
+        readonly=True,
+        copy=False)
+    
+    #----------------------------------------------------------
+    # Abstract
+    #----------------------------------------------------------
+    
     @abc.abstractmethod
     def type(self):
         """Returns the data type."""
@@ -43,6 +104,123 @@ class DataModel(models.AbstractModel):
     @abc.abstractmethod
     def update(self, values):
         """Updated the data object."""
+    
+    #----------------------------------------------------------
+    # Streaming
+    #----------------------------------------------------------
+    
+    def open_stream(self):
+        """Returns a seekable binary reader on the data object, which has to be
+        closed after use. Implementations should avoid loading the whole data
+        object into memory."""
+        self.ensure_one()
+        return io.BytesIO(base64.b64decode(self.content() or ""))
+    
+    def _content_length(self):
+        """Returns the length of the data object in bytes."""
+        with self.open_stream() as stream:
+            return stream.seek(0, io.SEEK_END)
+    
+    def _iter_content(self, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """Yields the bytes of the data object from start up to end (exclusive) in chunks."""
+        with self.open_stream() as stream:
+            stream.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                chunk = stream.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+    
+    #----------------------------------------------------------
+    # References
+    #----------------------------------------------------------
+    
+    def _share(self):
+        """Registers an additional file on the data objects and returns whether
+        they can be shared at all. Shared data objects are never changed, new
+        content is stored as a new data object instead."""
+        self.env.cr.execute(
+            "UPDATE %s SET reference_count = reference_count + 1 WHERE id IN %%s" % self._table,
+            (tuple(self.ids),))
+        self.invalidate_cache(['reference_count'], self.ids)
+        return True
+    
+    @api.model
+    def _dedupe(self, checksum, values=None):
+        """Registers an additional file on an existing data object with the given
+        checksum and returns it. The reference count is increased in the same
+        statement, so that a data object released concurrently isn't reused.
+        
+        :param values: dictionary of further column values the data object must have
+        """
+        values = dict(values or {}, checksum=checksum)
+        where = " AND ".join('"%s" = %%(%s)s' % (column, column) for column in values)
+        self.env.cr.execute("""
+            UPDATE "{table}" SET reference_count = reference_count + 1
+            WHERE id = (
+                SELECT id FROM "{table}" WHERE {where} AND reference_count > 0 
+                ORDER BY id LIMIT 1)
+            RETURNING id
+        """.format(table=self._table, where=where), values)
+        row = self.env.cr.fetchone()
+        if row:
+            self.invalidate_cache(['reference_count'], [row[0]])
+        return self.browse(row and row[0])
+    
+    def _release(self):
+        """Unregisters a file from the data objects and returns the data objects
+        which are no longer used by any file."""
+        self.env.cr.execute(
+            "UPDATE %s SET reference_count = reference_count - 1 WHERE id IN %%s RETURNING id, reference_count" % self._table,
+            (tuple(self.ids),))
+        unused = [row[0] for row in self.env.cr.fetchall() if row[1] <= 0]
+        self.invalidate_cache(['reference_count'], self.ids)
+        return self.browse(unused)
+    
+    @api.model
+    def _copy_references(self, table):
+        """Provides copied files with the data of their originals. The files are
+        given by a table mapping the originals (old_id) to the copies (new_id).
+        By default the data objects are shared between the files."""
+        self.env.cr.execute("""
+            UPDATE {data} data SET reference_count = data.reference_count + copies.count
+            FROM (
+                SELECT split_part(f.reference, ',', 2)::integer AS id, count(*) AS count
+                FROM muk_dms_file f JOIN {table} copy ON copy.new_id = f.id
+                WHERE split_part(f.reference, ',', 1) = %s
+                GROUP BY 1
+            ) copies WHERE data.id = copies.id AND {shared}
+        """.format(data=self._table, table=table, shared=self._shared_condition()), (self._name,))
+        self.invalidate_cache(['reference_count'])
+    
+    def _shared_condition(self):
+        """Returns the SQL condition on the data objects (data), which can be shared."""
+        return "true"
+    
+    def _compute_checksum(self, file):
+        return hashlib.sha1(file).hexdigest()
+    
+    def _compute_checksum_path(self, file_path):
+        checksum = hashlib.sha1()
+        with open(file_path, "rb") as file_handler:
+            for chunk in iter(lambda: file_handler.read(CHUNK_SIZE), b""):
+                checksum.update(chunk)
+        return checksum.hexdigest()
+    
+    def _ensure_checksum(self):
+        """Returns the checksum of the content and computes it for data objects,
+        which have been created without one."""
+        self.ensure_one()
+        if not self.checksum:
+            checksum = hashlib.sha1()
+            with self.open_stream() as stream:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    checksum.update(chunk)
+            self.write({'checksum': checksum.hexdigest()})
+        return self.checksum
         
 class DatabaseDataModel(models.Model):
     _name = 'muk_dms.data_database'
@@ -57,6 +235,18 @@ class DatabaseDataModel(models.Model):
     data = fields.Binary(
         string="Content")
     
+    @api.model_cr_context
+    def _auto_init(self):
+        result = super(DatabaseDataModel, self)._auto_init()
+        # compressed values have to be decompressed as a whole to read a part of them
+        self._cr.execute("""
+            SELECT attstorage FROM pg_attribute 
+            WHERE attrelid = 'muk_dms_data_database'::regclass AND attname = 'data'
+        """)
+        if self._cr.fetchone()[0] != 'e':
+            self._cr.execute("ALTER TABLE muk_dms_data_database ALTER COLUMN data SET STORAGE EXTERNAL")
+        return result
+    
     #----------------------------------------------------------
     # Abstract Implementation
     #----------------------------------------------------------
@@ -69,8 +259,76 @@ class DatabaseDataModel(models.Model):
     
     def update(self, values):
         if 'content' in values:
-            self.data = values['content']
+            # data objects are shared between files of the same content
+            raise ValidationError(_("The content of a stored file can't be changed."))
     
     def delete(self):
         self.file = None
+    
+    def open_stream(self):
+        self.ensure_one()
+        return io.BufferedReader(DatabaseStream(self), CHUNK_SIZE)
+    
+    def _content_length(self):
+        self.ensure_one()
+        self.env.cr.execute("""
+            SELECT octet_length(data), substring(data FROM greatest(octet_length(data) - 1, 1) FOR 2)
+            FROM muk_dms_data_database WHERE id = %s
+        """, (self.id,))
+        length, tail = self.env.cr.fetchone()
+        if not length:
+            return 0
+        return length // 4 * 3 - bytes(tail).count("=")
+    
+    def _read_content(self, start, size):
+        # the content is stored base64 encoded without line breaks, every 3 bytes 
+        # are encoded by 4 characters, which allows to read aligned parts of the column
+        offset = start - start % 3
+        self.env.cr.execute("""
+            SELECT substring(data FROM %s FOR %s) FROM muk_dms_data_database WHERE id = %s
+        """, (offset // 3 * 4 + 1, (start + size - offset + 2) // 3 * 4, self.id))
+        data = base64.b64decode(bytes(self.env.cr.fetchone()[0] or b""))
+        return data[start - offset:start - offset + size]
+    
+    #----------------------------------------------------------
+    # Content Addressing
+    #----------------------------------------------------------
+    
+    @api.model
+    def _store(self, content):
+        """Returns a data object with the given content, which is shared with
+        other files of the same content if possible. The content is stored without
+        line breaks, so that it can be read in parts."""
+        file = base64.b64decode(content or "")
+        checksum = self._compute_checksum(file)
+        return self._dedupe(checksum) or self.create({'data': base64.b64encode(file), 'checksum': checksum})
+    
+    @api.model
+    def _store_path(self, file_path, checksum=None):
+        """Returns a data object with the content of the given file, which is read in
+        chunks. The encoded chunks are collected in a temporary table and joined by
+        the database, so that the file is never loaded as a whole."""
+        checksum = checksum or self._compute_checksum_path(file_path)
+        reference = self._dedupe(checksum)
+        if not reference:
+            reference = self.create({'checksum': checksum})
+            self.env.cr.execute("""
+                DROP TABLE IF EXISTS muk_dms_data_chunk;
+                CREATE TEMP TABLE muk_dms_data_chunk (
+                    sequence integer, chunk bytea) ON COMMIT DROP;
+            """)
+            with open(file_path, "rb") as file_handler:
+                for sequence, chunk in enumerate(iter(lambda: file_handler.read(CHUNK_SIZE // 3 * 3), b"")):
+                    self.env.cr.execute(
+                        "INSERT INTO muk_dms_data_chunk (sequence, chunk) VALUES (%s, %s)",
+                        (sequence, psycopg2.Binary(base64.b64encode(chunk))))
+            self.env.cr.execute("""
+                UPDATE muk_dms_data_database SET data = COALESCE((
+                    SELECT string_agg(chunk, ''::bytea ORDER BY sequence) 
+                    FROM muk_dms_data_chunk), ''::bytea)
+                WHERE id = %s;
+                DROP TABLE muk_dms_data_chunk;
+            """, (reference.id,))
+            reference.invalidate_cache(['data'], reference.ids)
+        return reference
     
\ No newline at end of file
@@ -23,22 +23,25 @@ import os
 import json
 import base64
 import logging
+import psycopg2
 
 from odoo import _
 from odoo import models, api, fields
 from odoo.exceptions import ValidationError, AccessError
 
+from odoo.addons.muk_dms.fields import dms_fields
 from odoo.addons.muk_dms.models import dms_base
 
 _logger = logging.getLogger(__name__)
 
-_img_path = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static/src/img'))
 
 class Directory(dms_base.DMSModel):
     _name = 'muk_dms.directory'
     _description = "MuK Documents Directory"
     
     _inherit = 'muk_dms.access'
+    
+    _trigram_fields = ['name', 'path']
 
     _parent_store = True
     _parent_name = "parent_directory"
@@ -102,10 +105,11 @@ class Directory(dms_base.DMSModel):
         compute='_compute_count_files',
         string="Files")
     
-    size = fields.Integer(
-        compute='_compute_size',
+    size = dms_fields.BigInteger(
         string="Size", 
-        store=True)    
+        readonly=True,
+        copy=False,
+        default=0)    
     
     custom_thumbnail = fields.Binary(
         string="Custom Thumbnail")
@@ -113,6 +117,10 @@ class Directory(dms_base.DMSModel):
     thumbnail = fields.Binary(
         compute='_compute_thumbnail',
         string="Thumbnail")
+    
+    thumbnail_url = fields.Char(
+        compute='_compute_thumbnail_url',
+        string="Thumbnail URL")
         
     path = fields.Char(
         string="Path",
@@ -124,23 +132,104 @@ class Directory(dms_base.DMSModel):
         store=True,
         readonly=True,
         compute='_compute_relational_path')
+    
+    _sql_constraints = [
+        ('name_uniq', 'unique (parent_directory, name)', 'A directory with the same name already exists.')
+    ]
         
     #----------------------------------------------------------
     # Functions
     #----------------------------------------------------------
     
     def lock_tree(self, user=None, refresh=False, operation=None, lock_self=True):
-        if lock_self:
-            self.lock(operation=operation)
-        for record in self:
-            record.child_directories.lock_tree(operation=operation)
-            record.files.lock(operation=operation)
+        if not self:
+            return
+        params = self._subtree_params(lock_self)
+        params.update({
+            'operation': operation, 'uid': self.env.uid, 
+            'locked_by': user and user.name or "System",
+            'locked_by_ref': user and "%s,%s" % (user._name, user.id) or None,
+            'lease': self.env['muk_dms.lock']._lease(user)})
+        self.env.cr.execute("""
+            WITH %s
+            SELECT l.id FROM muk_dms_lock l
+            JOIN subtree s ON l.res_model = s.res_model AND l.res_id = s.res_id
+            WHERE l.operation IS DISTINCT FROM %%(operation)s
+            AND (l.expiry IS NULL OR l.expiry > (now() at time zone 'UTC'))
+            LIMIT 1
+        """ % self._subtree_query(), params)
+        if self.env.cr.fetchone():
+            raise AccessError(_("The record is locked, so it can't be locked again."))
+        if not user and self._advisory_locks():
+            self.env['muk_dms.lock'].sudo()._advisory_lock_tree(self)
+            return
+        self.env.cr.execute("""
+            WITH %s
+            DELETE FROM muk_dms_lock l USING subtree s
+            WHERE l.res_model = s.res_model AND l.res_id = s.res_id
+            AND l.expiry <= (now() at time zone 'UTC')
+        """ % self._subtree_query(), params)
+        self.env.cr.execute("""
+            WITH %s
+            INSERT INTO muk_dms_lock (
+                create_uid, create_date, write_uid, write_date,
+                locked_by, locked_by_ref, res_model, res_id, token, operation, expiry)
+            SELECT %%(uid)s, (now() at time zone 'UTC'), %%(uid)s, (now() at time zone 'UTC'),
+                %%(locked_by)s, %%(locked_by_ref)s, s.res_model, s.res_id, 
+                md5(random()::text || clock_timestamp()::text), %%(operation)s,
+                (now() at time zone 'UTC') + %%(lease)s * interval '1 second'
+            FROM subtree s 
+            WHERE NOT EXISTS (
+                SELECT 1 FROM muk_dms_lock l 
+                WHERE l.res_model = s.res_model AND l.res_id = s.res_id)
+        """ % self._subtree_query(), params)
+        self.env['muk_dms.lock'].invalidate_cache()
+        if refresh:
+            self.refresh()
             
-    def unlock_tree(self, refresh=False):
-        self.unlock()
-        for record in self:
-            record.child_directories.unlock_tree()
-            record.files.unlock()
+    def unlock_tree(self, refresh=False, operation=None):
+        if not self or self._advisory_locks():
+            return
+        params = self._subtree_params(True)
+        params.update({'operation': operation})
+        self.env.cr.execute("""
+            WITH %s
+            DELETE FROM muk_dms_lock l USING subtree s
+            WHERE l.res_model = s.res_model AND l.res_id = s.res_id
+            AND l.operation IS NOT NULL AND (%%(operation)s IS NULL OR l.operation = %%(operation)s)
+        """ % self._subtree_query(), params)
+        self.env['muk_dms.lock'].invalidate_cache()
+        if refresh:
+            self.refresh()
+    
+    def _lock_directories(self):
+        return self
+    
+    def _advisory_locks(self):
+        settings = self.mapped('settings')
+        return bool(settings) and all(
+            setting.system_locks_mode == 'advisory' for setting in settings)
+    
+    def _subtree_params(self, include_self=True):
+        return {
+            'lefts': [record.parent_left for record in self],
+            'rights': [record.parent_right for record in self],
+            'include_self': include_self}
+    
+    def _subtree_query(self):
+        return """
+            tree AS (
+                SELECT * FROM unnest(%(lefts)s::integer[], %(rights)s::integer[]) AS t(parent_left, parent_right)
+            ), subtree AS (
+                SELECT 'muk_dms.directory'::varchar AS res_model, d.id AS res_id 
+                FROM muk_dms_directory d JOIN tree t 
+                ON d.parent_left >= t.parent_left AND d.parent_right <= t.parent_right
+                AND (%(include_self)s OR d.parent_left != t.parent_left)
+                UNION
+                SELECT 'muk_dms.file'::varchar AS res_model, f.id AS res_id 
+                FROM muk_dms_file f JOIN muk_dms_directory d ON f.directory = d.id JOIN tree t 
+                ON d.parent_left >= t.parent_left AND d.parent_right <= t.parent_right
+            )"""
     
     def notify_change(self, values, refresh=False, operation=None):
         super(Directory, self).notify_change(values, refresh)
@@ -157,38 +246,310 @@ class Directory(dms_base.DMSModel):
         if parent_directory:
             parent_directory.trigger_computation(fields, False)
             
-    def trigger_computation_down(self, fields, operation=None):
-        if self.settings.system_locks:
-                self.lock_tree(operation=operation, lock_self=False)
-        for child in self.child_directories:
-            child.with_context(is_subnode=True).trigger_computation(fields, False, operation)
-        for index, file in enumerate(self.files):
-            if index == len(self.files) - 1:
-                if self.env.context.get('is_subnode'):
-                    file.trigger_computation(fields, False, operation) 
-                else:
-                    file.trigger_computation(fields, True, operation) 
-            else:
-                file.trigger_computation(fields, False, operation)
-        self.unlock_tree()
-            
     def trigger_computation(self, fields, refresh=True, operation=None):
         super(Directory, self).trigger_computation(fields, refresh, operation)
-        values = {}
+        if "settings" in fields or "path" in fields:
+            self._recompute_subtree(fields, operation)
+            if refresh:
+                self.env['muk_dms.file'].refresh()
+    
+    #----------------------------------------------------------
+    # Subtree
+    #----------------------------------------------------------
+    
+    def _recompute_subtree(self, fields, operation=None):
+        """Recomputes the settings and paths of the directory and of all its
+        subdirectories and files with a fixed number of SQL statements.
+        
+        The subtree is selected through the nested set (parent_left/parent_right),
+        the new paths are built by replacing the old path prefix of the directory.
+        """
+        self.ensure_one()
+        if self.env.context.get('defer_parent_store_computation'):
+            self._parent_store_compute()
+        self.env.cr.execute("""
+            SELECT parent_left, parent_right, path, relational_path
+            FROM muk_dms_directory WHERE id = %s
+        """, (self.id,))
+        left, right, old_path, old_relational_path = self.env.cr.fetchone()
+        self._check_subtree_lock(left, right, operation)
+        files = self.env['muk_dms.file']
         if "settings" in fields:
-            if not self.is_root_directory:
-                values.update(self.with_context(operation=operation)._compute_settings(write=False))
+            settings = self.settings if self.is_root_directory else self.parent_directory.settings
+            files = self._update_subtree_settings(left, right, settings)
+            self._renew_tree_locks(operation)
         if "path" in fields:
-            values.update(self.with_context(operation=operation)._compute_path(write=False))
-            values.update(self.with_context(operation=operation)._compute_relational_path(write=False))
-        if "size" in fields:
-            values.update(self.with_context(operation=operation)._compute_size(write=False))
-        if values:
-            self.write(values);   
-            if "settings" in fields or "path" in fields:
-                self.trigger_computation_down(fields, operation)
-            if "size" in fields:
-                self.trigger_computation_up(fields, operation)
+            path = self._compute_path(write=False)['path']
+            relational_path = self._compute_relational_path(write=False)['relational_path']
+            self._update_subtree_paths(left, right, old_path, path, old_relational_path, relational_path)
+            if old_path and old_path != path:
+                self._update_subtree_references(left, right, old_path, path)
+            self._renew_tree_locks(operation)
+        self.invalidate_cache(['settings', 'path', 'relational_path'])
+        self.env['muk_dms.file'].invalidate_cache(['settings', 'path', 'relational_path'])
+        for file in files:
+            file.notify_change({'save_type': file.settings.save_type})
+            self._renew_tree_locks(operation)
+    
+    def _renew_tree_locks(self, operation=None):
+        """Extends the leases of the locks held by the operation, which has to
+        be called regularly by long running operations on the tree."""
+        if operation:
+            self.env['muk_dms.lock'].sudo()._renew_locks(operation)
+    
+    def _check_subtree_lock(self, left, right, operation=None):
+        self.env.cr.execute("""
+            SELECT l.id FROM muk_dms_lock l
+            LEFT JOIN muk_dms_directory d ON l.res_model = 'muk_dms.directory' AND d.id = l.res_id
+            LEFT JOIN muk_dms_file f ON l.res_model = 'muk_dms.file' AND f.id = l.res_id
+            LEFT JOIN muk_dms_directory fd ON fd.id = f.directory
+            WHERE ((d.parent_left >= %(left)s AND d.parent_right <= %(right)s) OR
+                (fd.parent_left >= %(left)s AND fd.parent_right <= %(right)s))
+            AND ((l.operation IS NOT NULL AND l.operation IS DISTINCT FROM %(operation)s) OR 
+                (l.locked_by_ref IS NOT NULL AND l.locked_by_ref != %(user)s))
+            AND (l.expiry IS NULL OR l.expiry > (now() at time zone 'UTC'))
+            LIMIT 1
+        """, {'left': left, 'right': right, 'operation': operation, 
+              'user': "%s,%s" % (self.env.user._name, self.env.user.id)})
+        if self.env.cr.fetchone():
+            raise AccessError(_("The directory tree is locked, so it can't be changed."))
+    
+    def _update_subtree_settings(self, left, right, settings):
+        params = {'left': left, 'right': right, 'settings': settings.id or None,
+                  'save_type': settings.save_type or None, 'uid': self.env.uid}
+        self.env.cr.execute("""
+            UPDATE muk_dms_directory SET 
+                settings = %(settings)s,
+                write_uid = %(uid)s, 
+                write_date = (now() at time zone 'UTC')
+            WHERE parent_left >= %(left)s AND parent_right <= %(right)s
+            AND settings IS DISTINCT FROM %(settings)s
+        """, params)
+        self.env.cr.execute("""
+            SELECT f.id FROM muk_dms_file f
+            JOIN muk_dms_directory d ON f.directory = d.id
+            JOIN muk_dms_settings s ON f.settings = s.id
+            WHERE d.parent_left >= %(left)s AND d.parent_right <= %(right)s
+            AND s.save_type != %(save_type)s
+        """, params)
+        migrate = [row[0] for row in self.env.cr.fetchall()]
+        self.env.cr.execute("""
+            UPDATE muk_dms_file f SET 
+                settings = %(settings)s,
+                write_uid = %(uid)s, 
+                write_date = (now() at time zone 'UTC')
+            FROM muk_dms_directory d
+            WHERE f.directory = d.id
+            AND d.parent_left >= %(left)s AND d.parent_right <= %(right)s
+            AND f.settings IS DISTINCT FROM %(settings)s
+        """, params)
+        return self.env['muk_dms.file'].browse(migrate)
+    
+    def _update_subtree_paths(self, left, right, old_path, path, old_relational_path, relational_path):
+        params = {'left': left, 'right': right, 'uid': self.env.uid,
+                  'old_path': old_path or "", 'path': path, 
+                  'old_relational_path': old_relational_path,
+                  'relational_path': relational_path}
+        self.env.cr.execute("""
+            UPDATE muk_dms_directory SET
+                path = %(path)s || COALESCE(substr(path, length(%(old_path)s) + 1), ''),
+                relational_path = (
+                    SELECT json_agg(elements.e ORDER BY elements.o)::text FROM (
+                        SELECT p.e, p.o FROM json_array_elements(%(relational_path)s::json) WITH ORDINALITY AS p(e, o)
+                        UNION ALL
+                        SELECT r.e, r.o + json_array_length(%(relational_path)s::json)
+                        FROM json_array_elements(relational_path::json) WITH ORDINALITY AS r(e, o)
+                        WHERE r.o > json_array_length(%(old_relational_path)s::json)) AS elements),
+                write_uid = %(uid)s, 
+                write_date = (now() at time zone 'UTC')
+            WHERE parent_left >= %(left)s AND parent_right <= %(right)s
+        """, params)
+        self.env.cr.execute("""
+            UPDATE muk_dms_file f SET
+                path = %(path)s || COALESCE(substr(f.path, length(%(old_path)s) + 1), ''),
+                relational_path = (
+                    SELECT json_agg(elements.e ORDER BY elements.o)::text FROM (
+                        SELECT p.e, p.o FROM json_array_elements(%(relational_path)s::json) WITH ORDINALITY AS p(e, o)
+                        UNION ALL
+                        SELECT r.e, r.o + json_array_length(%(relational_path)s::json)
+                        FROM json_array_elements(f.relational_path::json) WITH ORDINALITY AS r(e, o)
+                        WHERE r.o > json_array_length(%(old_relational_path)s::json)) AS elements),
+                write_uid = %(uid)s, 
+                write_date = (now() at time zone 'UTC')
+            FROM muk_dms_directory d
+            WHERE f.directory = d.id
+            AND d.parent_left >= %(left)s AND d.parent_right <= %(right)s
+        """, params)
+    
+    def _update_subtree_references(self, left, right, old_path, path):
+        pass
+    
+    def _copy_subtree(self, directory, operation=None):
+        """Copies the subdirectories and files of the directory into the given new
+        directory with a fixed number of SQL statements.
+        
+        The nested set is widened once for the whole copy, whose rows keep the
+        relative parent_left/parent_right of their originals. The data of the
+        files is shared with the originals until it is changed.
+        """
+        self.ensure_one()
+        if self.env.context.get('defer_parent_store_computation'):
+            self._parent_store_compute()
+        self.env.cr.execute("""
+            SELECT s.parent_right - s.parent_left - 1, s.size, t.parent_right
+            FROM muk_dms_directory s, muk_dms_directory t
+            WHERE s.id = %s AND t.id = %s
+        """, (self.id, directory.id))
+        shift, size, target_right = self.env.cr.fetchone()
+        if shift:
+            self.env.cr.execute("""
+                UPDATE muk_dms_directory SET parent_left = parent_left + %(shift)s 
+                WHERE parent_left > %(right)s;
+                UPDATE muk_dms_directory SET parent_right = parent_right + %(shift)s 
+                WHERE parent_right >= %(right)s;
+            """, {'shift': shift, 'right': target_right})
+        self.env.cr.execute("""
+            SELECT s.parent_left, s.parent_right, t.parent_left
+            FROM muk_dms_directory s, muk_dms_directory t
+            WHERE s.id = %s AND t.id = %s
+        """, (self.id, directory.id))
+        left, right, target_left = self.env.cr.fetchone()
+        params = {'source': self.id, 'target': directory.id, 'left': left, 'right': right,
+                  'target_left': target_left, 'settings': directory.settings.id or None}
+        self.env.cr.execute("""
+            DROP TABLE IF EXISTS muk_dms_copy_directory;
+            CREATE TEMP TABLE muk_dms_copy_directory ON COMMIT DROP AS
+                SELECT id AS old_id, nextval('muk_dms_directory_id_seq')::integer AS new_id, 
+                    parent_directory AS parent
+                FROM muk_dms_directory 
+                WHERE parent_left > %(left)s AND parent_right < %(right)s;
+            CREATE INDEX ON muk_dms_copy_directory (old_id);
+            UPDATE muk_dms_copy_directory copy SET parent = COALESCE((
+                SELECT p.new_id FROM muk_dms_copy_directory p 
+                WHERE p.old_id = copy.parent), %(target)s);
+            DROP TABLE IF EXISTS muk_dms_copy_file;
+            CREATE TEMP TABLE muk_dms_copy_file ON COMMIT DROP AS
+                SELECT f.id AS old_id, nextval('muk_dms_file_id_seq')::integer AS new_id, 
+                    COALESCE(d.new_id, %(target)s) AS directory
+                FROM muk_dms_file f LEFT JOIN muk_dms_copy_directory d ON d.old_id = f.directory
+                WHERE f.directory = %(source)s OR d.old_id IS NOT NULL;
+            CREATE INDEX ON muk_dms_copy_file (new_id);
+            ANALYZE muk_dms_copy_directory;
+            ANALYZE muk_dms_copy_file;
+        """, params)
+        self._renew_tree_locks(operation)
+        self._copy_rows('muk_dms_copy_directory', {
+            'parent_directory': "copy.parent",
+            'parent_left': "%(target_left)s + source.parent_left - %(left)s",
+            'parent_right': "%(target_left)s + source.parent_right - %(left)s",
+            'is_root_directory': "false",
+            'settings': "%(settings)s",
+            'path': "NULL",
+            'relational_path': "NULL",
+        }, params)
+        self.env['muk_dms.file']._copy_rows('muk_dms_copy_file', {
+            'directory': "copy.directory",
+            'settings': "%(settings)s",
+            'path': "NULL",
+            'relational_path': "NULL",
+        }, params)
+        self.env.cr.execute("""
+            WITH RECURSIVE tree(id, path, relational_path) AS (
+                SELECT id, path, relational_path FROM muk_dms_directory WHERE id = %(target)s
+                UNION ALL
+                SELECT d.id, tree.path || d.name || '/', left(tree.relational_path, -1) || ', ' || 
+                    json_build_object('model', 'muk_dms.directory', 'id', d.id, 'name', d.name)::text || ']'
+                FROM muk_dms_directory d JOIN tree ON d.parent_directory = tree.id
+            )
+            UPDATE muk_dms_directory d SET path = tree.path, relational_path = tree.relational_path
+            FROM tree WHERE d.id = tree.id AND d.id != %(target)s;
+            UPDATE muk_dms_file f SET path = d.path || f.name, relational_path = 
+                left(d.relational_path, -1) || ', ' || 
+                json_build_object('model', 'muk_dms.file', 'id', f.id, 'name', f.name)::text || ']'
+            FROM muk_dms_copy_file copy, muk_dms_directory d
+            WHERE f.id = copy.new_id AND d.id = f.directory;
+            UPDATE muk_dms_directory SET size = %(size)s WHERE id = %(target)s;
+        """, dict(params, size=size or 0))
+        self._propagate_size({directory.parent_directory.id: size or 0})
+        self.env.cr.execute("""
+            SELECT DISTINCT split_part(f.reference, ',', 1) FROM muk_dms_file f
+            JOIN muk_dms_copy_file copy ON copy.new_id = f.id
+            WHERE f.reference IS NOT NULL
+        """)
+        for model in [row[0] for row in self.env.cr.fetchall()]:
+            self.env[model].sudo()._copy_references('muk_dms_copy_file')
+            self._renew_tree_locks(operation)
+        self.env.cr.execute("""
+            SELECT copy.new_id FROM muk_dms_copy_file copy
+            JOIN muk_dms_file f ON f.id = copy.old_id
+            JOIN muk_dms_settings s ON s.id = f.settings
+            WHERE s.save_type IS DISTINCT FROM %s
+        """, (directory.settings.save_type or None,))
+        files = self.env['muk_dms.file'].browse([row[0] for row in self.env.cr.fetchall()])
+        self.invalidate_cache()
+        self.env['muk_dms.file'].invalidate_cache()
+        for file in files:
+            file.notify_change({'save_type': file.settings.save_type})
+            self._renew_tree_locks(operation)
+    
+    #----------------------------------------------------------
+    # Size
+    #----------------------------------------------------------
+    
+    @api.model
+    def _propagate_size(self, deltas):
+        """Adds the given byte deltas to the directories and all their ancestors.
+        
+        :param deltas: dictionary which maps directory ids to byte deltas
+        """
+        deltas = dict((key, value) for key, value in deltas.items() if key and value)
+        if not deltas:
+            return
+        self.env.cr.execute("""
+            WITH delta AS (
+                SELECT a.id, SUM(v.size) AS size
+                FROM unnest(%s::integer[], %s::bigint[]) AS v(directory, size)
+                JOIN muk_dms_directory c ON c.id = v.directory
+                JOIN muk_dms_directory a ON a.parent_left <= c.parent_left AND a.parent_right >= c.parent_right
+                GROUP BY a.id
+            ), locked AS (
+                SELECT d.id FROM muk_dms_directory d 
+                WHERE d.id IN (SELECT id FROM delta) 
+                ORDER BY d.id FOR UPDATE
+            )
+            UPDATE muk_dms_directory d SET size = COALESCE(d.size, 0) + delta.size
+            FROM delta WHERE d.id = delta.id AND d.id IN (SELECT id FROM locked)
+            RETURNING d.id
+        """, (list(deltas.keys()), list(deltas.values())))
+        self.invalidate_cache(['size'], [row[0] for row in self.env.cr.fetchall()])
+        
+    @api.multi
+    def _reconcile_size(self):
+        """Recomputes the stored size of the directories from their files to fix
+        any drift caused by the incremental updates. Without any given records all
+        directories are reconciled, which is used by the scheduled action.
+        """
+        self.env.cr.execute("""
+            WITH own AS (
+                SELECT directory, SUM(COALESCE(size, 0)) AS size
+                FROM muk_dms_file GROUP BY directory
+            ), total AS (
+                SELECT a.id, COALESCE(SUM(own.size), 0) AS size
+                FROM muk_dms_directory a
+                JOIN muk_dms_directory c ON c.parent_left >= a.parent_left AND c.parent_right <= a.parent_right
+                LEFT JOIN own ON own.directory = c.id
+                WHERE %s OR a.id IN %s
+                GROUP BY a.id
+            )
+            UPDATE muk_dms_directory d SET size = total.size
+            FROM total WHERE d.id = total.id AND d.size IS DISTINCT FROM total.size
+            RETURNING d.id
+        """, (not self.ids, tuple(self.ids) or (None,)))
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        if ids:
+            _logger.info("Reconciled the size of %s directories.", len(ids))
+            self.invalidate_cache(['size'], ids)
+        return True
         
     #----------------------------------------------------------
     # Read, View 
@@ -237,21 +598,6 @@ class Directory(dms_base.DMSModel):
             self.ensure_one()
             return {'relational_path': get_relational_path(self)}        
     
-    def _compute_size(self, write=True):
-        def get_size(record):
-            size = 0
-            for directory in record.child_directories:
-                size += directory.size
-            for file in record.files:
-                size += file.size
-            return size
-        if write:
-            for record in self:
-                record.size = get_size(record)
-        else:
-            self.ensure_one()
-            return {'size': get_size(self)}        
-    
     @api.depends('child_directories')
     def _compute_count_directories(self):
         for record in self:
@@ -268,8 +614,15 @@ class Directory(dms_base.DMSModel):
             if record.custom_thumbnail:
                 record.thumbnail = record.with_context({}).custom_thumbnail        
             else:
-                with open(os.path.join(_img_path, "folder.png"), "rb") as image_file:
-                    record.thumbnail = base64.b64encode(image_file.read())
+                record.thumbnail = dms_base.icon_content(dms_base.icon_name())
+    
+    @api.depends('custom_thumbnail')
+    def _compute_thumbnail_url(self):
+        for record in self:
+            if record.with_context(bin_size=True).custom_thumbnail:
+                record.thumbnail_url = record._thumbnail_url()
+            else:
+                record.thumbnail_url = dms_base.icon_url(dms_base.icon_name())
              
     #----------------------------------------------------------
     # Create, Update, Delete
@@ -282,6 +635,21 @@ class Directory(dms_base.DMSModel):
         else:
            self.settings = None
     
+    @api.model_cr_context
+    def _auto_init(self):
+        result = super(Directory, self)._auto_init()
+        self._cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', ('muk_dms_directory_root_name_uniq',))
+        if not self._cr.fetchone():
+            try:
+                with self._cr.savepoint():
+                    self._cr.execute("""
+                        CREATE UNIQUE INDEX muk_dms_directory_root_name_uniq 
+                        ON muk_dms_directory (settings, name) WHERE is_root_directory
+                    """)
+            except psycopg2.IntegrityError:
+                _logger.warning("Root directories with the same name exist, unable to add unique index.")
+        return result
+    
     def _before_create(self, vals):
         vals = super(Directory, self)._before_create(vals)
         is_root_directory = vals["is_root_directory"] if "is_root_directory" in vals else False
@@ -298,16 +666,19 @@ class Directory(dms_base.DMSModel):
         if not self.is_root_directory and not self.parent_directory:
             raise ValidationError("A directory has to have a parent directory.")
         
-    @api.constrains('name')
+    @api.constrains('name', 'parent_directory')
     def _check_name(self):
-        if not self.check_name(self.name):
-            raise ValidationError("The directory name is invalid.")
-        if self.is_root_directory:
-            childs = self.settings.root_directories.mapped(lambda rec: [rec.id, rec.name])
-        else:
-            childs = self.parent_directory.child_directories.mapped(lambda rec: [rec.id, rec.name])
-        duplicates = [rec for rec in childs if rec[1] == self.name and rec[0] != self.id]
-        if duplicates:
+        for record in self:
+            if not record.check_name(record.name):
+                raise ValidationError("The directory name is invalid.")
+        self.env.cr.execute("""
+            SELECT d.id FROM muk_dms_directory d
+            JOIN muk_dms_directory o ON o.name = d.name AND o.id != d.id AND (
+                (d.is_root_directory AND o.is_root_directory AND o.settings = d.settings) OR
+                (NOT d.is_root_directory AND o.parent_directory = d.parent_directory))
+            WHERE d.id IN %s LIMIT 1
+        """, (tuple(self.ids),))
+        if self.env.cr.fetchone():
             raise ValidationError("A directory with the same name already exists.")
     
     def _after_create(self, vals):
@@ -315,6 +686,16 @@ class Directory(dms_base.DMSModel):
         record._check_recomputation(vals)
         return record
         
+    def _before_write(self, vals, operation):
+        vals = super(Directory, self)._before_write(vals, operation)
+        if 'parent_directory' in vals:
+            deltas = {vals['parent_directory']: 0}
+            for record in self.filtered(lambda rec: rec.size):
+                deltas[record.parent_directory.id] = deltas.get(record.parent_directory.id, 0) - record.size
+                deltas[vals['parent_directory']] += record.size
+            self._propagate_size(deltas)
+        return vals
+        
     def _after_write_record(self, vals, operation):
         vals = super(Directory, self)._after_write_record(vals, operation)
         self._check_recomputation(vals, operation)
@@ -335,23 +716,19 @@ class Directory(dms_base.DMSModel):
     def copy(self, default=None):
         self.ensure_one()
         default = dict(default or [])
-        names = []
         if self.is_root_directory:
-            names = self.settings.root_directories.mapped('name')
+            siblings = {'settings': self.settings.id, 'is_root_directory': True}
             default.update({'settings': self.settings.id})
-        elif 'parent_directory' in default:
-            parent_directory = self.env['muk_dms.directory'].browse(default['parent_directory'])
-            names = parent_directory.child_directories.mapped('name')
         else:
-            names = self.parent_directory.child_directories.mapped('name')
-        default.update({'name': self.unique_name(self.name, names)})
+            siblings = {'parent_directory': default.get('parent_directory', self.parent_directory.id)}
+        default.update({'name': self._unique_name(self.name, siblings)})
+        parent = default.get('parent_directory')
+        if parent and self.search([('id', '=', parent), ('id', 'child_of', self.id)]):
+            raise ValidationError(_("A directory can't be copied into itself."))
         vals = self.copy_data(default)[0]
         new = self.with_context(lang=None).create(vals)
         self.copy_translations(new)
-        for file in self.files:
-            file.copy({'directory': new.id})
-        for directory in self.child_directories:
-            directory.copy({'parent_directory': new.id})
+        self._copy_subtree(new, self.env.context.get('operation'))
         return new
             
     def _before_unlink_record(self):
@@ -19,24 +19,30 @@
 #
 ###################################################################################
 
+import io
 import os
-import re
 import json
-import base64
 import logging
 import mimetypes
 
 from odoo import _
 from odoo import models, api, fields
-from odoo.tools import ustr
 from odoo.tools.mimetypes import guess_mimetype
 from odoo.exceptions import ValidationError, AccessError
 
+from odoo.addons.muk_dms.fields import dms_fields
 from odoo.addons.muk_dms.models import dms_base
+from odoo.addons.muk_dms.models import dms_rendition
 
 _logger = logging.getLogger(__name__)
 
-_img_path = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static/src/img'))
+MIMETYPE_HEADER_SIZE = 4096
+
+INDEX_CONFIG = 'simple'
+
+# tsvectors are limited to 1 MB, so only the beginning of long texts is indexed
+INDEX_VECTOR_LIMIT = 100000
+
 
 class File(dms_base.DMSModel):
     _name = 'muk_dms.file'
@@ -44,6 +50,8 @@ class File(dms_base.DMSModel):
     
     _inherit = 'muk_dms.access'
     
+    _trigram_fields = ['name', 'path']
+    
     #----------------------------------------------------------
     # Database
     #----------------------------------------------------------
@@ -76,7 +84,8 @@ class File(dms_base.DMSModel):
         string="Directory",
         ondelete='restrict',  
         auto_join=True,
-        required=True)
+        required=True,
+        index=True)
     
     extension = fields.Char(
         string='Extension',
@@ -90,7 +99,7 @@ class File(dms_base.DMSModel):
         readonly=True,
         store=True)
     
-    size = fields.Integer(
+    size = dms_fields.BigInteger(
         string='Size', 
         readonly=True)
     
@@ -101,6 +110,20 @@ class File(dms_base.DMSModel):
         compute='_compute_thumbnail',
         string="Thumbnail")
     
+    thumbnail_url = fields.Char(
+        compute='_compute_thumbnail_url',
+        string="Thumbnail URL")
+    
+    thumbnail_state = fields.Selection(
+        selection=[
+            ('pending', "Pending"),
+            ('done', "Done"),
+            ('none', "None")],
+        string="Thumbnail State",
+        readonly=True,
+        index=True,
+        copy=False)
+    
     path = fields.Char(
         string="Path",
         store=True,
@@ -120,10 +143,19 @@ class File(dms_base.DMSModel):
         store=True,
         prefetch=False)
     
+    index_search = fields.Char(
+        string='Content',
+        compute='_compute_index_search',
+        search='_search_index_search')
+    
     locked_by = fields.Reference(
         string='Locked by',
         related='locked.locked_by_ref')
     
+    _sql_constraints = [
+        ('name_uniq', 'unique (directory, name)', 'A file with the same name already exists.')
+    ]
+    
     #----------------------------------------------------------
     # Functions
     #----------------------------------------------------------
@@ -131,7 +163,7 @@ class File(dms_base.DMSModel):
     def notify_change(self, values, refresh=False, operation=None):
         super(File, self).notify_change(values, refresh, operation)
         if "index_files" in values:
-            self._compute_index()
+            self.env['muk_dms.index_queue'].sudo()._enqueue(self)
         if "save_type" in values:
             self._update_reference_type()
             
@@ -152,7 +184,7 @@ class File(dms_base.DMSModel):
         if "mimetype" in fields:
             values.update(self.with_context(operation=operation)._compute_mimetype(write=False)) 
         if "index_content" in fields:
-            values.update(self.with_context(operation=operation)._compute_index(write=False)) 
+            self.env['muk_dms.index_queue'].sudo()._enqueue(self)
         if values:
             self.write(values);     
             if "settings" in fields:
@@ -181,8 +213,9 @@ class File(dms_base.DMSModel):
     def _compute_mimetype(self, write=True):
         def get_mimetype(record):
             mimetype = mimetypes.guess_type(record.name)[0]
-            if (not mimetype or mimetype == 'application/octet-stream') and record.content:
-                mimetype = guess_mimetype(base64.b64decode(record.content))
+            if (not mimetype or mimetype == 'application/octet-stream') and record.reference:
+                with record.open_stream() as stream:
+                    mimetype = guess_mimetype(stream.read(MIMETYPE_HEADER_SIZE))
             return mimetype or 'application/octet-stream'
         if write:
             for record in self:
@@ -216,11 +249,10 @@ class File(dms_base.DMSModel):
     
     def _compute_index(self, write=True):
         def get_index(record):
-            type = record.mimetype.split('/')[0] if record.mimetype else record._compute_mimetype(write=False)['mimetype']  
+            mimetype = record.mimetype or record._compute_mimetype(write=False)['mimetype']
             index_files = record.settings.index_files if record.settings else record.directory.settings.index_files
-            if type and type.split('/')[0] == 'text' and record.content and index_files:
-                words = re.findall("[^\x00-\x1F\x7F-\xFF]{4,}", base64.b64decode(record.content))
-                return ustr("\n".join(words))
+            if index_files and record.reference:
+                return self.env['muk_dms.extraction'].sudo()._extract(record.reference.sudo(), mimetype)
             else:
                 return None   
         if write:
@@ -234,36 +266,158 @@ class File(dms_base.DMSModel):
         for record in self:
             record.content = record._get_content()
             
-    @api.depends('custom_thumbnail')
+    @api.depends('custom_thumbnail', 'thumbnail_state')
     def _compute_thumbnail(self):
         for record in self:
+            rendition = not record.custom_thumbnail and record._get_rendition()
             if record.custom_thumbnail:
-                record.thumbnail = record.with_context({}).custom_thumbnail        
+                record.thumbnail = record.with_context({}).custom_thumbnail 
+            elif rendition:
+                record.thumbnail = rendition.data
+            else:
+                record.thumbnail = dms_base.icon_content(dms_base.icon_name(record.extension or ""))
+    
+    @api.depends('custom_thumbnail', 'extension', 'reference', 'thumbnail_state')
+    def _compute_thumbnail_url(self):
+        for record in self:
+            if record.with_context(bin_size=True).custom_thumbnail:
+                record.thumbnail_url = record._thumbnail_url()
+            elif record.thumbnail_state == 'done' and record.reference:
+                record.thumbnail_url = "/dms/thumbnail/%s?unique=%s" % (
+                    record.id, record.reference.sudo().checksum)
             else:
-                extension = record.extension and record.extension.strip(".") or ""
-                path = os.path.join(_img_path, "file_%s.png" % extension)
-                if not os.path.isfile(path):
-                    path = os.path.join(_img_path, "file_unkown.png")
-                with open(path, "rb") as image_file:
-                    record.thumbnail = base64.b64encode(image_file.read())
+                record.thumbnail_url = dms_base.icon_url(dms_base.icon_name(record.extension or ""))
             
+    def _update_index(self):
+        """Extracts the index of the file. The index is written directly, since
+        it is updated by the index queue independent of the file locks."""
+        self.ensure_one()
+        self.env.cr.execute("UPDATE muk_dms_file SET index_content = %s WHERE id = %s", 
+            (self._compute_index(write=False)['index_content'], self.id))
+        self.invalidate_cache(['index_content'], [self.id])
+    
+    def _compute_index_search(self):
+        for record in self:
+            record.index_search = False
+    
+    def _search_index_search(self, operator, value):
+        if operator not in ('=', 'ilike', 'like') or not value:
+            return [('index_content', operator, value)]
+        return [('id', 'inselect', ("""
+            SELECT id FROM muk_dms_file WHERE index_vector @@ plainto_tsquery(%s, %s)
+        """, (INDEX_CONFIG, value)))]
+    
+    #----------------------------------------------------------
+    # Search
+    #----------------------------------------------------------
+    
+    @api.model_cr_context
+    def _auto_init(self):
+        result = super(File, self)._auto_init()
+        self._cr.execute("""
+            SELECT 1 FROM information_schema.columns 
+            WHERE table_name = 'muk_dms_file' AND column_name = 'index_vector'
+        """)
+        if not self._cr.fetchone():
+            self._cr.execute("ALTER TABLE muk_dms_file ADD COLUMN index_vector tsvector")
+            self._cr.execute("""
+                UPDATE muk_dms_file SET index_vector = 
+                    setweight(to_tsvector(%(config)s, coalesce(name, '')), 'A') ||
+                    setweight(to_tsvector(%(config)s, left(coalesce(index_content, ''), %(limit)s)), 'B')
+            """, {'config': INDEX_CONFIG, 'limit': INDEX_VECTOR_LIMIT})
+        self._cr.execute("""
+            CREATE OR REPLACE FUNCTION muk_dms_file_index_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.index_vector := 
+                    setweight(to_tsvector('{config}', coalesce(NEW.name, '')), 'A') ||
+                    setweight(to_tsvector('{config}', left(coalesce(NEW.index_content, ''), {limit})), 'B');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """.format(config=INDEX_CONFIG, limit=INDEX_VECTOR_LIMIT))
+        self._cr.execute("""
+            DROP TRIGGER IF EXISTS muk_dms_file_index_vector ON muk_dms_file;
+            CREATE TRIGGER muk_dms_file_index_vector 
+            BEFORE INSERT OR UPDATE OF name, index_content ON muk_dms_file
+            FOR EACH ROW EXECUTE PROCEDURE muk_dms_file_index_vector()
+        """)
+        self._cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', ('muk_dms_file_index_vector_idx',))
+        if not self._cr.fetchone():
+            self._cr.execute("CREATE INDEX muk_dms_file_index_vector_idx ON muk_dms_file USING gin (index_vector)")
+        return result
+    
+    @api.model
+    def search_content(self, query, domain=None, limit=20, offset=0):
+        """Searches the indexed content of the files and returns the hits ordered 
+        by their rank together with a highlighted snippet of the matching text."""
+        if not query or not query.strip():
+            return []
+        where_query = self._where_calc((domain or []) + self._access_domain('read'))
+        self._apply_ir_rules(where_query, 'read')
+        from_clause, where_clause, where_params = where_query.get_sql()
+        self.env.cr.execute("""
+            SELECT hits.id, hits.rank, ts_headline(%s, coalesce(f.index_content, f.name), q.query,
+                'StartSel=<b>, StopSel=</b>, MaxFragments=2') 
+            FROM (
+                SELECT "muk_dms_file".id AS id, 
+                    ts_rank_cd("muk_dms_file".index_vector, plainto_tsquery(%s, %s)) AS rank
+                FROM {tables}
+                WHERE "muk_dms_file".index_vector @@ plainto_tsquery(%s, %s) {where}
+                ORDER BY rank DESC, "muk_dms_file".id
+                LIMIT %s OFFSET %s
+            ) hits
+            JOIN muk_dms_file f ON f.id = hits.id
+            CROSS JOIN plainto_tsquery(%s, %s) q(query)
+            ORDER BY hits.rank DESC, hits.id
+        """.format(tables=from_clause, where=where_clause and "AND %s" % where_clause or ""), 
+            [INDEX_CONFIG, INDEX_CONFIG, query, INDEX_CONFIG, query] + where_params + 
+            [limit, offset, INDEX_CONFIG, query])
+        hits = self.env.cr.fetchall()
+        files = self.browse([hit[0] for hit in hits])
+        return [{
+            'id': file.id,
+            'name': file.name,
+            'path': file.path,
+            'mimetype': file.mimetype,
+            'rank': rank,
+            'snippet': snippet,
+        } for file, (id, rank, snippet) in zip(files, hits)]
+    
     #----------------------------------------------------------
     # Create, Update, Delete
     #----------------------------------------------------------
     
-    @api.constrains('name')
+    @api.constrains('name', 'directory')
     def _check_name(self):
-        if not self.check_name(self.name):
-            raise ValidationError("The file name is invalid.")
-        childs = self.directory.files.mapped(lambda rec: [rec.id, rec.name])
-        duplicates = [rec for rec in childs if rec[1] == self.name and rec[0] != self.id]
-        if duplicates:
+        for record in self:
+            if not record.check_name(record.name):
+                raise ValidationError("The file name is invalid.")
+        self.env.cr.execute("""
+            SELECT f.id FROM muk_dms_file f
+            JOIN muk_dms_file o ON o.directory = f.directory AND o.name = f.name AND o.id != f.id
+            WHERE f.id IN %s LIMIT 1
+        """, (tuple(self.ids),))
+        if self.env.cr.fetchone():
             raise ValidationError("A file with the same name already exists.")
     
     def _after_create(self, vals):
         record = super(File, self)._after_create(vals)
+        if vals.get('size'):
+            record.directory._propagate_size({record.directory.id: vals['size']})
         record._check_recomputation(vals)
         return record
+    
+    def _before_write(self, vals, operation):
+        vals = super(File, self)._before_write(vals, operation)
+        if 'size' in vals or 'directory' in vals:
+            deltas = {}
+            for record in self:
+                directory = vals.get('directory', record.directory.id)
+                size = vals.get('size', record.size) or 0
+                deltas[record.directory.id] = deltas.get(record.directory.id, 0) - (record.size or 0)
+                deltas[directory] = deltas.get(directory, 0) + size
+            self.env['muk_dms.directory']._propagate_size(deltas)
+        return vals
         
     def _after_write_record(self, vals, operation):
         vals = super(File, self)._after_write_record(vals, operation)
@@ -281,8 +435,8 @@ class File(dms_base.DMSModel):
         if fields:
             self.trigger_computation(fields)
         self._check_reference_values(values)
-        if 'size' in values:
-            self.trigger_computation_up(['size'])
+        if 'content' in values or 'reference' in values or 'name' in values:
+            self._queue_thumbnails()
                 
     def _inverse_content(self):
         for record in self:
@@ -290,14 +444,13 @@ class File(dms_base.DMSModel):
                 content = record.content
                 directory = record.directory
                 settings = record.settings if record.settings else directory.settings
-                reference = record.reference
-                if reference:
+                if record.reference:
                     record._update_reference_content(content)
                 else:
                     reference = record._create_reference(
                         settings, directory.path, record.name, content)
-                record.reference = "%s,%s" % (reference._name, reference.id)
-                record.size = len(base64.b64decode(content))
+                    record.reference = "%s,%s" % (reference._name, reference.id)
+                record.size = record.reference.sudo()._content_length()
             else:
                 record._unlink_reference()
                 record.reference = None
@@ -306,21 +459,90 @@ class File(dms_base.DMSModel):
     def copy(self, default=None):
         self.ensure_one()
         default = dict(default or [])
-        names = self.directory.files.mapped('name')
-        default.update({'name': self.unique_name(self.name, names, self.extension)})
+        directory = default.get('directory', self.directory.id)
+        default.update({'name': self._unique_name(self.name, {'directory': directory}, self.extension)})
         vals = self.copy_data(default)[0]
-        if 'reference' in vals:
-            del vals['reference']
-        if not 'content' in vals:
-            vals.update({'content': self.content})
+        shared = 'content' not in vals and self.reference and self.reference.sudo()._share()
+        if shared:
+            vals.update({'reference': "%s,%s" % (self.reference._name, self.reference.id)})
+        else:
+            if 'reference' in vals:
+                del vals['reference']
+            if not 'content' in vals:
+                vals.update({'content': self.content})
         new = self.with_context(lang=None).create(vals)
         self.copy_translations(new)
+        if shared:
+            new._update_reference_type()
         return new
     
+    def _before_unlink(self):
+        result = super(File, self)._before_unlink()
+        deltas = {}
+        for record in self:
+            deltas[record.directory.id] = deltas.get(record.directory.id, 0) - (record.size or 0)
+        self.env['muk_dms.directory']._propagate_size(deltas)
+        return result
+    
     def _before_unlink_record(self):
         super(File, self)._before_unlink_record()
         self._unlink_reference()
                         
+    def _lock_directories(self):
+        return self.mapped('directory')
+    
+    #----------------------------------------------------------
+    # Thumbnails
+    #----------------------------------------------------------
+    
+    def _queue_thumbnails(self):
+        """Marks the files for the thumbnail generation. The state is written
+        directly to avoid another write cycle while the content is written."""
+        if self.ids:
+            self.env.cr.execute("""
+                UPDATE muk_dms_file SET thumbnail_state = CASE 
+                    WHEN mimetype LIKE 'image/%%' OR mimetype = 'application/pdf' 
+                    THEN 'pending' ELSE 'none' END
+                WHERE id IN %s
+            """, (tuple(self.ids),))
+            self.invalidate_cache(['thumbnail_state'], self.ids)
+    
+    def _get_rendition(self, size=dms_rendition.THUMBNAIL_SIZE):
+        self.ensure_one()
+        if self.thumbnail_state != 'done' or not self.reference:
+            return self.env['muk_dms.rendition']
+        reference = self.reference.sudo()
+        return self.env['muk_dms.rendition'].sudo()._fetch(reference.checksum, size)
+    
+    @api.model
+    def _generate_thumbnails(self, limit=100):
+        """Renders the thumbnails of pending files. Each file is processed
+        in its own savepoint, so that broken content doesn't stop the queue."""
+        renditions = self.env['muk_dms.rendition'].sudo()
+        for record in self.sudo().search([('thumbnail_state', '=', 'pending')], limit=limit):
+            state = 'none'
+            try:
+                with self.env.cr.savepoint():
+                    reference = record.reference
+                    if reference:
+                        checksum = reference._ensure_checksum()
+                        for size in dms_rendition.THUMBNAIL_SIZES:
+                            if renditions._fetch(checksum, size):
+                                state = 'done'
+                                continue
+                            with reference.open_stream() as stream:
+                                data = renditions._render(stream, record.mimetype, size)
+                            if not data:
+                                break
+                            renditions._store(checksum, size, data)
+                            state = 'done'
+            except Exception:
+                _logger.exception("Failed to generate the thumbnail of file %s.", record.id)
+                state = 'none'
+            self.env.cr.execute(
+                "UPDATE muk_dms_file SET thumbnail_state = %s WHERE id = %s", (state, record.id))
+            record.invalidate_cache(['thumbnail_state'], [record.id])
+    
     #----------------------------------------------------------
     # Reference
     #----------------------------------------------------------
@@ -329,13 +551,38 @@ class File(dms_base.DMSModel):
         self.ensure_one()
         self.check_access('create', raise_exception=True)
         if settings.save_type == 'database':
-            return self.env['muk_dms.data_database'].sudo().create({'data': content})
+            return self.env['muk_dms.data_database'].sudo()._store(content)
         return None
     
+    def _create_reference_from_path(self, settings, file_path, checksum=None):
+        self.ensure_one()
+        self.check_access('create', raise_exception=True)
+        if settings.save_type == 'database':
+            return self.env['muk_dms.data_database'].sudo()._store_path(file_path, checksum)
+        return None
+    
+    def _update_content_from_path(self, file_path, checksum=None):
+        """Replaces the content of the file by the given file without loading it
+        into memory. Depending on the storage the file is consumed. The checksum
+        of the content is computed from the file unless it is given."""
+        self.ensure_one()
+        self.check_access('write', raise_exception=True)
+        size = os.path.getsize(file_path)
+        settings = self.settings or self.directory.settings
+        reference = self.sudo()._create_reference_from_path(settings, file_path, checksum)
+        self._release_reference()
+        self.write({
+            'reference': "%s,%s" % (reference._name, reference.id),
+            'size': size})
+        self.trigger_computation(['mimetype', 'index_content'])
+    
     def _update_reference_content(self, content):
         self.ensure_one()     
         self.check_access('write', raise_exception=True)
-        self.reference.sudo().update({'content': content})
+        settings = self.settings or self.directory.settings
+        reference = self.sudo()._create_reference(settings, self.directory.path, self.name, content)
+        self._release_reference()
+        self.reference = "%s,%s" % (reference._name, reference.id)
     
     def _update_reference_type(self):
         self.ensure_one()     
@@ -348,11 +595,20 @@ class File(dms_base.DMSModel):
     def _check_reference_values(self, values):
         self.ensure_one()
         self.check_access('write', raise_exception=True)
-        if 'content' in values:
+        if 'content' in values and self.reference:
             self._update_reference_content(values['content'])
         if 'settings' in values:
             self._update_reference_type()
     
+    def open_stream(self):
+        """Returns a seekable binary reader on the content of the file, which
+        reads the content in chunks and has to be closed after use."""
+        self.ensure_one()
+        self.check_access('read', raise_exception=True)
+        if not self.reference:
+            return io.BytesIO()
+        return self.reference.sudo().open_stream()
+    
     def _get_content(self):
         self.ensure_one()
         self.check_access('read', raise_exception=True)
@@ -361,6 +617,11 @@ class File(dms_base.DMSModel):
     def _unlink_reference(self):
         self.ensure_one()
         self.check_access('unlink', raise_exception=True)
+        self._release_reference()
+    
+    def _release_reference(self):
         if self.reference:
-            self.reference.sudo().delete()
-            self.reference.sudo().unlink()
\ No newline at end of file
+            unused = self.reference.sudo()._release()
+            if unused:
+                unused.delete()
+                unused.unlink()
\ No newline at end of file
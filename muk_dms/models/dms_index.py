@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+import os
+import sys
+import time
+import shutil
+import logging
+import resource
+import tempfile
+import threading
+import subprocess
+
+from odoo import _
+from odoo import models, api, fields
+from odoo.tools import ustr
+from odoo.exceptions import UserError
+
+from odoo.addons.muk_dms.tools import extract
+
+_logger = logging.getLogger(__name__)
+
+INDEX_BATCH_SIZE = 50
+INDEX_TIME_LIMIT = 240
+INDEX_MAX_ATTEMPTS = 5
+INDEX_RETRY_DELAY = 300
+
+EXTRACT_TIME_LIMIT = 60
+EXTRACT_MEMORY_LIMIT = 512
+
+class IndexQueue(models.Model):
+    _name = 'muk_dms.index_queue'
+    _description = "Index Queue"
+    _order = 'next_attempt, id'
+    
+    file = fields.Many2one(
+        'muk_dms.file', 
+        string="File",
+        ondelete='cascade',
+        required=True,
+        readonly=True)
+    
+    state = fields.Selection(
+        selection=[
+            ('pending', "Pending"),
+            ('failed', "Failed")],
+        string="State",
+        default='pending',
+        required=True,
+        readonly=True,
+        index=True)
+    
+    attempts = fields.Integer(
+        string="Attempts",
+        default=0,
+        readonly=True)
+    
+    next_attempt = fields.Datetime(
+        string="Next Attempt",
+        readonly=True,
+        index=True)
+    
+    error = fields.Text(
+        string="Error",
+        readonly=True)
+    
+    _sql_constraints = [
+        ('file_uniq', 'unique (file)', 'The file is already queued!')
+    ]
+    
+    #----------------------------------------------------------
+    # Queue
+    #----------------------------------------------------------
+    
+    @api.model
+    def _enqueue(self, files):
+        """Queues the files for indexing. Files, which are already queued,
+        are reset so that they are indexed again with their current content."""
+        if files:
+            self._enqueue_query("SELECT unnest(%s)", (list(files.ids),))
+        
+    @api.model
+    def _enqueue_settings(self, settings):
+        if settings:
+            self._enqueue_query("SELECT id FROM muk_dms_file WHERE settings IN %s", (tuple(settings.ids),))
+    
+    def _enqueue_query(self, query, params):
+        self.env.cr.execute("""
+            INSERT INTO muk_dms_index_queue (
+                create_uid, create_date, write_uid, write_date, 
+                file, state, attempts, next_attempt)
+            SELECT %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'), 
+                q.id, 'pending', 0, (now() at time zone 'UTC')
+            FROM ({query}) q(id)
+            ON CONFLICT (file) DO UPDATE SET 
+                state = 'pending', attempts = 0, error = NULL,
+                next_attempt = EXCLUDED.next_attempt
+        """.format(query=query), (self.env.uid, self.env.uid) + tuple(params))
+        self.invalidate_cache()
+    
+    @api.model
+    def _process(self, batch_size=INDEX_BATCH_SIZE, time_limit=INDEX_TIME_LIMIT):
+        """Indexes queued files in batches until the queue is empty or the time
+        limit is reached. Each batch is committed on its own. The jobs are locked
+        with SKIP LOCKED, so that several cron workers can process the queue at the
+        same time without indexing a file twice. The time limit is checked before
+        each job, the jobs of a batch which haven't been started are released with
+        the commit."""
+        deadline = time.time() + time_limit
+        processed = 0
+        expired = False
+        while not expired:
+            self.env.cr.execute("""
+                SELECT id, file FROM muk_dms_index_queue
+                WHERE state = 'pending' AND next_attempt <= (now() at time zone 'UTC')
+                ORDER BY next_attempt, id
+                LIMIT %s FOR UPDATE SKIP LOCKED
+            """, (batch_size,))
+            jobs = self.env.cr.fetchall()
+            if not jobs:
+                break
+            for job_id, file_id in jobs:
+                if time.time() >= deadline:
+                    expired = True
+                    break
+                self._process_job(job_id, self.env['muk_dms.file'].sudo().browse(file_id))
+                processed += 1
+            self.env.cr.commit()
+        if processed:
+            _logger.info("Indexed %s queued files.", processed)
+        return processed
+    
+    def _process_job(self, job_id, file):
+        try:
+            with self.env.cr.savepoint():
+                if file.exists():
+                    file._update_index()
+            self.env.cr.execute("DELETE FROM muk_dms_index_queue WHERE id = %s", (job_id,))
+        except Exception as error:
+            _logger.warning("Failed to index file %s.", file.id, exc_info=True)
+            self.env.cr.execute("""
+                UPDATE muk_dms_index_queue SET 
+                    attempts = attempts + 1, error = %s,
+                    state = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE 'pending' END,
+                    next_attempt = (now() at time zone 'UTC') + 
+                        power(2, attempts) * %s * interval '1 second'
+                WHERE id = %s
+            """, (ustr(error), INDEX_MAX_ATTEMPTS, INDEX_RETRY_DELAY, job_id))
+    
+    @api.model
+    def _progress(self, settings):
+        """Returns the number of pending and failed jobs per settings."""
+        result = dict((id, {'pending': 0, 'failed': 0}) for id in settings.ids)
+        if settings:
+            self.env.cr.execute("""
+                SELECT f.settings, q.state, count(*)
+                FROM muk_dms_index_queue q JOIN muk_dms_file f ON f.id = q.file
+                WHERE f.settings IN %s
+                GROUP BY f.settings, q.state
+            """, (tuple(settings.ids),))
+            for settings_id, state, count in self.env.cr.fetchall():
+                result[settings_id][state] = count
+        return result
+    
+    def action_retry(self):
+        self.write({'state': 'pending', 'attempts': 0, 'next_attempt': fields.Datetime.now()})
+
+class TextExtraction(models.Model):
+    _name = 'muk_dms.extraction'
+    _description = "Text Extraction Cache"
+    
+    checksum = fields.Char(
+        string="Checksum",
+        required=True,
+        index=True)
+    
+    text = fields.Text(
+        string="Text")
+    
+    _sql_constraints = [
+        ('checksum_uniq', 'unique (checksum)', 'The content has already been extracted!')
+    ]
+    
+    #----------------------------------------------------------
+    # Extraction
+    #----------------------------------------------------------
+    
+    @api.model
+    def _extract(self, reference, mimetype):
+        """Returns the text of the data object. The text is extracted by a separate 
+        process and cached by the checksum of the content, so that identical content 
+        is extracted only once."""
+        if not self._extractor_command(mimetype, None):
+            return None
+        checksum = reference._ensure_checksum()
+        cache = self.search([('checksum', '=', checksum)], limit=1)
+        if cache:
+            return cache.text
+        with tempfile.NamedTemporaryFile(prefix='muk_dms_extract_') as temp_file:
+            with reference.open_stream() as stream:
+                shutil.copyfileobj(stream, temp_file)
+            temp_file.flush()
+            text = ustr(self._run(self._extractor_command(mimetype, temp_file.name)), errors='replace')
+        self.env.cr.execute("""
+            INSERT INTO muk_dms_extraction (create_uid, create_date, write_uid, write_date, checksum, text)
+            VALUES (%s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'), %s, %s)
+            ON CONFLICT (checksum) DO NOTHING
+        """, (self.env.uid, self.env.uid, checksum, text))
+        return text
+    
+    @api.model
+    def _extractor_command(self, mimetype, path):
+        """Returns the command to extract the text of the given file or None if
+        the mimetype isn't supported. Override to plug in further extractors."""
+        if extract.get_extractor(mimetype):
+            return [sys.executable, os.path.abspath(extract.__file__.replace('.pyc', '.py')), mimetype, path or ""]
+        return None
+    
+    @api.model
+    def _run(self, command):
+        """Runs the extractor with limited CPU time and memory. The process is 
+        killed once the time limit is exceeded."""
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        time_limit = int(get_param('muk_dms.extract_time_limit', EXTRACT_TIME_LIMIT))
+        memory_limit = int(get_param('muk_dms.extract_memory_limit', EXTRACT_MEMORY_LIMIT)) * 1024 * 1024
+        def limit():
+            resource.setrlimit(resource.RLIMIT_CPU, (time_limit, time_limit))
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, 
+            stderr=subprocess.PIPE, preexec_fn=limit, close_fds=True)
+        timer = threading.Timer(time_limit, process.kill)
+        timer.start()
+        try:
+            output, error = process.communicate()
+        finally:
+            timer.cancel()
+        if process.returncode != 0:
+            raise UserError(_("The text extraction failed (%s): %s") % (
+                process.returncode, ustr(error, errors='replace')[-1000:]))
+        return output
+    
+    @api.model
+    def _garbage_collect(self):
+        """Removes the extracted text of content, which is no longer stored."""
+        checksums = " UNION ALL ".join(
+            "SELECT checksum FROM %s" % self.env[model]._table 
+            for model in self.env['muk_dms.data']._inherit_children)
+        self.env.cr.execute("""
+            DELETE FROM muk_dms_extraction e WHERE NOT EXISTS (
+                SELECT 1 FROM ({checksums}) c WHERE c.checksum = e.checksum)
+        """.format(checksums=checksums))
+        if self.env.cr.rowcount:
+            _logger.info("Removed %s unused text extractions.", self.env.cr.rowcount)
+            self.invalidate_cache()
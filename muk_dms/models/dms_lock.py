@@ -19,12 +19,20 @@
 #
 ###################################################################################
 
+import os
+import zlib
+import hashlib
 import logging
 
+from odoo import _
 from odoo import models, api, fields
+from odoo.exceptions import AccessError
 
 _logger = logging.getLogger(__name__)
 
+SYSTEM_LOCK_LEASE = 900
+USER_LOCK_LEASE = 86400
+
 class Lock(models.Model):
     _name = 'muk_dms.lock'
     _description = "Directory or File Lock"
@@ -40,11 +48,19 @@ class Lock(models.Model):
     locked_by_ref = fields.Reference(
         [('res.users', 'User')],
         string="User Reference")
+    
+    res_model = fields.Char(
+        string="Object Model",
+        required=True)
+    
+    res_id = fields.Integer(
+        string="Object ID",
+        required=True)
 
     lock_ref = fields.Reference(
-        [],
-        string="Object Reference",
-        required=True)
+        selection='_selection_res_model',
+        compute='_compute_lock_ref',
+        string="Object Reference")
     
     token = fields.Char(
         string="Token")
@@ -52,7 +68,180 @@ class Lock(models.Model):
     operation = fields.Char(
         string="Operation")
     
-    @api.one
-    @api.depends('lock_ref')
+    expiry = fields.Datetime(
+        string="Expiry",
+        index=True,
+        help="The lock is ignored and removed once it has expired. Long running " +
+             "operations renew the lease of their locks.")
+    
+    _sql_constraints = [
+        ('res_uniq', 'unique (res_model, res_id)', 'The object is already locked!')
+    ]
+    
+    #----------------------------------------------------------
+    # Locking
+    #----------------------------------------------------------
+    
+    @api.model
+    def _fetch_locks(self, records):
+        """Returns the locks of the given records as a dictionary which
+        maps the record ids to their lock, using a single query."""
+        if not records.ids:
+            return {}
+        locks = self.search([
+            ('res_model', '=', records._name), 
+            ('res_id', 'in', records.ids),
+            '|', ('expiry', '=', False), 
+            ('expiry', '>', fields.Datetime.now())])
+        return dict((lock.res_id, lock) for lock in locks)
+    
+    @api.model
+    def _lock_records(self, records, user=None, operation=None):
+        if records.ids:
+            self.env.cr.execute("""
+                DELETE FROM muk_dms_lock 
+                WHERE res_model = %s AND res_id IN %s
+                AND expiry <= (now() at time zone 'UTC')
+            """, (records._name, tuple(records.ids)))
+        locks = self._fetch_locks(records)
+        for lock in locks.values():
+            if not lock.operation or lock.operation != operation:
+                raise AccessError(_("The record is locked, so it can't be locked again."))
+        missing = [id for id in records.ids if id not in locks]
+        if missing:
+            tokens = [hashlib.sha1(os.urandom(128)).hexdigest() for id in missing]
+            self.env.cr.execute("""
+                INSERT INTO muk_dms_lock (
+                    create_uid, create_date, write_uid, write_date,
+                    locked_by, locked_by_ref, res_model, res_id, token, operation, expiry)
+                SELECT %(uid)s, (now() at time zone 'UTC'), %(uid)s, (now() at time zone 'UTC'),
+                    %(locked_by)s, %(locked_by_ref)s, %(res_model)s, v.res_id, v.token, %(operation)s,
+                    (now() at time zone 'UTC') + %(lease)s * interval '1 second'
+                FROM unnest(%(ids)s::integer[], %(tokens)s::varchar[]) AS v(res_id, token)
+                ON CONFLICT (res_model, res_id) DO NOTHING
+                RETURNING id, res_id
+            """, {
+                'uid': self.env.uid,
+                'locked_by': user and user.name or "System",
+                'locked_by_ref': user and "%s,%s" % (user._name, user.id) or None,
+                'res_model': records._name,
+                'ids': missing,
+                'tokens': tokens,
+                'operation': operation,
+                'lease': self._lease(user)})
+            for id, res_id in self.env.cr.fetchall():
+                locks[res_id] = self.browse(id)
+            # records which have been locked concurrently in the meantime
+            if any(id not in locks for id in missing):
+                raise AccessError(_("The record is locked, so it can't be locked again."))
+        return [{
+            'record': record, 
+            'lock': locks[record.id], 
+            'token': locks[record.id].token} for record in records]
+    
+    @api.model
+    def _unlock_records(self, records):
+        if records.ids:
+            self.env.cr.execute("""
+                DELETE FROM muk_dms_lock 
+                WHERE res_model = %s AND res_id IN %s
+            """, (records._name, tuple(records.ids)))
+            self.invalidate_cache()
+        return True
+    
+    @api.model
+    def _advisory_key(self, model):
+        return zlib.crc32(model)
+    
+    @api.model
+    def _advisory_lock_tree(self, directories):
+        """Locks the given directory trees for the current transaction using
+        PostgreSQL advisory locks. The directories are locked exclusively and
+        their ancestors shared, so that operations on overlapping trees
+        exclude each other, while only a few locks per tree are required.
+        """
+        if not directories.ids:
+            return True
+        self.env.cr.execute("""
+            SELECT bool_and(pg_try_advisory_xact_lock_shared(%(key)s, a.id))
+            FROM muk_dms_directory a JOIN muk_dms_directory d
+            ON a.parent_left < d.parent_left AND a.parent_right > d.parent_right
+            WHERE d.id IN %(ids)s
+        """, {'key': self._advisory_key(directories._name), 'ids': tuple(directories.ids)})
+        shared = self.env.cr.fetchone()[0]
+        self.env.cr.execute("""
+            SELECT bool_and(pg_try_advisory_xact_lock(%(key)s, d.id))
+            FROM muk_dms_directory d WHERE d.id IN %(ids)s
+        """, {'key': self._advisory_key(directories._name), 'ids': tuple(directories.ids)})
+        exclusive = self.env.cr.fetchone()[0]
+        if shared is False or exclusive is False:
+            raise AccessError(_("The record is locked, so it can't be locked again."))
+        return True
+    
+    @api.model
+    def _advisory_check(self, directories):
+        """Locks the given directories and their ancestors shared for the current
+        transaction. This fails if another transaction has locked one of the trees
+        with _advisory_lock_tree, while locks of the own transaction are reentrant."""
+        if not directories.ids:
+            return True
+        self.env.cr.execute("""
+            SELECT bool_and(pg_try_advisory_xact_lock_shared(%(key)s, a.id))
+            FROM muk_dms_directory a JOIN muk_dms_directory d
+            ON a.parent_left <= d.parent_left AND a.parent_right >= d.parent_right
+            WHERE d.id IN %(ids)s
+        """, {'key': self._advisory_key(directories._name), 'ids': tuple(directories.ids)})
+        if self.env.cr.fetchone()[0] is False:
+            raise AccessError(_("The record is locked, so it can't be changes or deleted."))
+        return True
+    
+    @api.model
+    def _lease(self, user=None):
+        params = self.env['ir.config_parameter'].sudo()
+        if user:
+            return int(params.get_param('muk_dms.user_lock_lease', USER_LOCK_LEASE))
+        return int(params.get_param('muk_dms.system_lock_lease', SYSTEM_LOCK_LEASE))
+    
+    @api.model
+    def _renew_locks(self, operation):
+        """Heartbeat for long running operations, extends the lease of
+        all locks held by the given operation."""
+        self.env.cr.execute("""
+            UPDATE muk_dms_lock 
+            SET expiry = (now() at time zone 'UTC') + %s * interval '1 second'
+            WHERE operation = %s
+        """, (self._lease(), operation))
+        self.invalidate_cache(['expiry'])
+        return True
+    
+    @api.model
+    def _garbage_collect(self):
+        self.env.cr.execute("""
+            DELETE FROM muk_dms_lock 
+            WHERE expiry <= (now() at time zone 'UTC')
+        """)
+        if self.env.cr.rowcount:
+            _logger.info("Removed %s expired locks.", self.env.cr.rowcount)
+            self.invalidate_cache()
+    
+    #----------------------------------------------------------
+    # Read
+    #----------------------------------------------------------
+    
+    @api.model
+    def _selection_res_model(self):
+        models = self.env['ir.model'].sudo().search([])
+        return [(model.model, model.name) for model in models]
+    
+    @api.depends('res_model', 'res_id')
+    def _compute_lock_ref(self):
+        for record in self:
+            if record.res_model and record.res_id:
+                record.lock_ref = "%s,%s" % (record.res_model, record.res_id)
+            else:
+                record.lock_ref = None
+    
+    @api.depends('res_model', 'res_id')
     def _compute_name(self):
-        self.name = "Lock for " + str(self.lock_ref.name)
\ No newline at end of file
+        for record in self:
+            record.name = "Lock for " + str(record.lock_ref.name)
\ No newline at end of file
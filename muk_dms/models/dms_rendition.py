@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+import io
+import os
+import base64
+import shutil
+import logging
+import tempfile
+import subprocess
+
+import psycopg2
+
+from PIL import Image
+
+from odoo import _
+from odoo import models, api, fields
+from odoo.tools import find_in_path
+
+_logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 256
+THUMBNAIL_SIZES = (128, 256, 512)
+
+class Rendition(models.Model):
+    _name = 'muk_dms.rendition'
+    _description = "Rendition Cache"
+    
+    checksum = fields.Char(
+        string="Checksum",
+        required=True,
+        index=True)
+    
+    size = fields.Integer(
+        string="Size",
+        required=True)
+    
+    mimetype = fields.Char(
+        string="Type")
+    
+    data = fields.Binary(
+        string="Content")
+    
+    _sql_constraints = [
+        ('rendition_uniq', 'unique (checksum, size)', 'The rendition already exists!')
+    ]
+    
+    #----------------------------------------------------------
+    # Rendition
+    #----------------------------------------------------------
+    
+    @api.model
+    def _fetch(self, checksum, size):
+        return self.search([('checksum', '=', checksum), ('size', '=', size)], limit=1)
+    
+    @api.model
+    def _store(self, checksum, size, data, mimetype='image/png'):
+        """Stores the rendition unless it has been created concurrently."""
+        try:
+            with self.env.cr.savepoint():
+                return self.create({
+                    'checksum': checksum, 
+                    'size': size, 
+                    'mimetype': mimetype,
+                    'data': base64.b64encode(data)})
+        except psycopg2.IntegrityError:
+            return self._fetch(checksum, size)
+    
+    @api.model
+    def _render(self, stream, mimetype, size):
+        """Returns a PNG thumbnail of the given content or None if the type
+        of the content isn't supported."""
+        if mimetype and mimetype.startswith('image/'):
+            image = Image.open(stream)
+            image.draft('RGB', (size, size))
+            return self._render_image(image, size)
+        if mimetype == 'application/pdf':
+            return self._render_pdf(stream, size)
+        return None
+    
+    def _render_image(self, image, size):
+        image.thumbnail((size, size), Image.ANTIALIAS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        output = io.BytesIO()
+        image.save(output, 'PNG')
+        return output.getvalue()
+    
+    def _render_pdf(self, stream, size):
+        try:
+            pdftoppm = find_in_path('pdftoppm')
+        except IOError:
+            pdftoppm = None
+        if not pdftoppm:
+            return None
+        directory = tempfile.mkdtemp(prefix='muk_dms_rendition_')
+        try:
+            input_path = os.path.join(directory, 'input.pdf')
+            with open(input_path, 'wb') as input_file:
+                shutil.copyfileobj(stream, input_file)
+            output_path = os.path.join(directory, 'output')
+            subprocess.check_call([pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-png',
+                '-scale-to', str(size), input_path, output_path])
+            with open(output_path + '.png', 'rb') as output_file:
+                return self._render_image(Image.open(io.BytesIO(output_file.read())), size)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    
+    @api.model
+    def _garbage_collect(self):
+        """Removes the renditions of content, which is no longer stored."""
+        checksums = " UNION ALL ".join(
+            "SELECT checksum FROM %s" % self.env[model]._table 
+            for model in self.env['muk_dms.data']._inherit_children)
+        self.env.cr.execute("""
+            DELETE FROM muk_dms_rendition r WHERE NOT EXISTS (
+                SELECT 1 FROM ({checksums}) c WHERE c.checksum = r.checksum)
+        """.format(checksums=checksums))
+        if self.env.cr.rowcount:
+            _logger.info("Removed %s unused renditions.", self.env.cr.rowcount)
+            self.invalidate_cache()
@@ -58,6 +58,23 @@ class Settings(dms_base.DMSModel):
         default=True,
         help="Indicates if files and directories should be automatically locked while system operations take place.")
     
+    system_locks_mode = fields.Selection(
+        selection=[("table", _('Lock Table')), ("advisory", _('Advisory Locks'))], 
+        string="System Locks Mode", 
+        default="table", 
+        required=True,
+        help="Lock Table stores the system locks as lock records. Advisory Locks uses transaction-scoped " +
+             "PostgreSQL advisory locks instead, which are released automatically at commit or rollback. " +
+             "Changes to records inside a locked tree fail until the system operation has finished.")
+    
+    index_pending = fields.Integer(
+        compute='_compute_index_progress',
+        string="Pending Index Jobs")
+    
+    index_failed = fields.Integer(
+        compute='_compute_index_progress',
+        string="Failed Index Jobs")
+    
     root_directories = fields.One2many(
         'muk_dms.directory', 
         'settings',
@@ -72,11 +89,24 @@ class Settings(dms_base.DMSModel):
     def notify_change(self, values, refresh=False, operation=None):
         super(Settings, self).notify_change(values, refresh, operation)
         if self.system_locks:
-                self.root_directories.lock_tree(operation=operation)
+            self.root_directories.lock_tree(operation=operation)
         for directory in self.root_directories:
             directory.notify_change(values)
-        self.root_directories.lock_tree(operation=operation)
+            if self.system_locks:
+                self.env['muk_dms.lock'].sudo()._renew_locks(operation)
+        if self.system_locks:
+            self.root_directories.unlock_tree(operation=operation)
         
+    #----------------------------------------------------------
+    # Read, View 
+    #----------------------------------------------------------
+    
+    def _compute_index_progress(self):
+        progress = self.env['muk_dms.index_queue'].sudo()._progress(self)
+        for record in self:
+            record.index_pending = progress[record.id]['pending']
+            record.index_failed = progress[record.id]['failed']
+    
     #----------------------------------------------------------
     # Create, Update
     #----------------------------------------------------------
@@ -99,4 +129,4 @@ class Settings(dms_base.DMSModel):
         if 'save_type' in values:
             self.notify_change({'save_type': values['save_type']}, operation=operation)
         if 'index_files' in values:
-            self.notify_change({'index_files': values['index_files']}, operation=operation)
\ No newline at end of file
+            self.env['muk_dms.index_queue'].sudo()._enqueue_settings(self)
\ No newline at end of file
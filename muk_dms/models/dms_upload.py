@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+import os
+import errno
+import hashlib
+import logging
+import datetime
+
+import psycopg2
+
+from odoo import _
+from odoo import models, api, fields
+from odoo.tools import config
+from odoo.tools.lru import LRU
+from odoo.exceptions import ValidationError, AccessError
+
+from odoo.addons.muk_dms.fields import dms_fields
+from odoo.addons.muk_dms.models.dms_data import CHUNK_SIZE
+
+_logger = logging.getLogger(__name__)
+
+UPLOAD_LIFETIME = 86400
+
+# The state of the checksum can't be stored in the database, so it is kept per
+# process and token together with the number of bytes it covers. Uploads which
+# continue in another process compute the checksum from the file when finished.
+_checksums = LRU(256)
+
+class UploadOffsetError(ValidationError):
+    """Raised if a chunk doesn't continue the received data. The upload stays
+    valid and the client resumes it from the received offset."""
+
+class Upload(models.Model):
+    _name = 'muk_dms.upload'
+    _description = "Resumable Upload"
+    
+    token = fields.Char(
+        string="Token",
+        required=True,
+        readonly=True,
+        index=True,
+        copy=False,
+        default=lambda self: hashlib.sha1(os.urandom(128)).hexdigest())
+    
+    name = fields.Char(
+        string="Filename",
+        required=True)
+    
+    user = fields.Many2one(
+        'res.users', 
+        string="User",
+        ondelete='cascade',
+        required=True,
+        readonly=True,
+        index=True)
+    
+    directory = fields.Many2one(
+        'muk_dms.directory', 
+        string="Directory",
+        ondelete='cascade',
+        required=True)
+    
+    size = dms_fields.BigInteger(
+        string="Size",
+        required=True)
+    
+    received = dms_fields.BigInteger(
+        string="Received",
+        default=0)
+    
+    file = fields.Many2one(
+        'muk_dms.file', 
+        string="File",
+        ondelete='set null',
+        readonly=True)
+    
+    _sql_constraints = [
+        ('token_uniq', 'unique (token)', 'The upload token has to be unique!')
+    ]
+    
+    #----------------------------------------------------------
+    # Upload
+    #----------------------------------------------------------
+    
+    @api.model
+    def _start(self, directory, name, size):
+        """Starts an upload of a new file into the given directory. The access
+        rights are checked for the current user, who has to finish the upload."""
+        directory = self.env['muk_dms.directory'].browse(directory)
+        if not directory.exists() or not directory.check_access('create'):
+            raise AccessError(_("This operation is forbidden!"))
+        self.env['muk_dms.file'].check_access_rights('create')
+        if not self.env['muk_dms.file'].check_name(name):
+            raise ValidationError(_("The file name is invalid."))
+        if size < 0:
+            raise ValidationError(_("The file size is invalid."))
+        if self.env['muk_dms.file'].sudo().search_count([('directory', '=', directory.id), ('name', '=', name)]):
+            raise ValidationError(_("A file with the same name already exists."))
+        return self.sudo().create({
+            'user': self.env.uid,
+            'directory': directory.id,
+            'name': name,
+            'size': size})
+        
+    @api.model
+    def _find(self, token):
+        return self.sudo().search([
+            ('token', '=', token), 
+            ('user', '=', self.env.uid)], limit=1)
+    
+    @api.multi
+    def _append(self, offset, stream):
+        """Appends the chunk read from the given stream at the given offset. The
+        offset has to match the received bytes, otherwise the client has to resume
+        the upload from there. Once all bytes are received, the file is created."""
+        self.ensure_one()
+        self.env.cr.execute("SELECT received FROM muk_dms_upload WHERE id = %s FOR UPDATE", (self.id,))
+        received = self.env.cr.fetchone()[0]
+        if self.file or offset != received:
+            raise UploadOffsetError(_("The upload expects the data at offset %s.") % received)
+        file_path = self._temp_path()
+        self._ensure_dir(file_path)
+        checksum = self._checksum_state(offset)
+        with open(file_path, "r+b" if os.path.exists(file_path) else "wb") as file_handler:
+            # drop data of interrupted requests, which haven't been acknowledged
+            file_handler.seek(offset)
+            file_handler.truncate()
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                received += len(chunk)
+                if received > self.size:
+                    raise ValidationError(_("The upload exceeds the announced size."))
+                file_handler.write(chunk)
+                if checksum:
+                    checksum.update(chunk)
+        if checksum:
+            _checksums[self.token] = (received, checksum)
+        self.write({'received': received})
+        if received == self.size:
+            self._finish()
+        return received
+    
+    @api.multi
+    def _finish(self):
+        self.ensure_one()
+        file_path = self._temp_path()
+        if not os.path.exists(file_path):
+            open(file_path, "wb").close()
+        checksum = self._checksum_state(self.size)
+        try:
+            with self.env.cr.savepoint():
+                file = self.env['muk_dms.file'].sudo(self.user.id).create({
+                    'name': self.name, 
+                    'directory': self.directory.id})
+        except psycopg2.IntegrityError:
+            raise ValidationError(_("A file with the same name already exists."))
+        file._update_content_from_path(file_path, checksum and checksum.hexdigest())
+        self.write({'file': file.id})
+        self.env.cr.after('commit', lambda: self._remove_file(file_path))
+        
+    #----------------------------------------------------------
+    # Helper
+    #----------------------------------------------------------
+        
+    def _checksum_state(self, offset):
+        """Returns a copy of the checksum of the first offset bytes of the upload
+        if it is known to this process, otherwise None."""
+        if not offset:
+            return hashlib.sha1()
+        state = _checksums.get(self.token)
+        if state and state[0] == offset:
+            return state[1].copy()
+        return None
+    
+    def _temp_path(self):
+        return os.path.join(config.filestore(self.env.cr.dbname), 'muk_dms_upload', self.token)
+    
+    def _ensure_dir(self, file_path):
+        try:
+            os.makedirs(os.path.dirname(file_path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                _logger.error("Failed to create the upload directory: " + str(exc))
+                raise AccessError(_("The System failed to create the necessary directories."))
+    
+    def _remove_file(self, file_path):
+        try:
+            os.remove(file_path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                _logger.warning("Failed to remove the upload (%s): %s" % (file_path, str(exc)))
+    
+    @api.model
+    def _garbage_collect(self):
+        lifetime = int(self.env['ir.config_parameter'].sudo().get_param(
+            'muk_dms.upload_lifetime', UPLOAD_LIFETIME))
+        limit = datetime.datetime.utcnow() - datetime.timedelta(seconds=lifetime)
+        uploads = self.sudo().search([('write_date', '<', fields.Datetime.to_string(limit))])
+        if uploads:
+            _logger.info("Removed %s expired uploads.", len(uploads))
+            uploads.unlink()
+    
+    #----------------------------------------------------------
+    # Delete
+    #----------------------------------------------------------
+    
+    @api.multi
+    def unlink(self):
+        file_paths = [record._temp_path() for record in self]
+        result = super(Upload, self).unlink()
+        for file_path in file_paths:
+            self.env.cr.after('commit', lambda file_path=file_path: self._remove_file(file_path))
+        return result
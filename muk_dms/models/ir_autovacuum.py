@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+
+import logging
+
+from odoo import _
+from odoo import models, api, fields
+
+_logger = logging.getLogger(__name__)
+
+class AutoVacuum(models.AbstractModel):
+    _inherit = 'ir.autovacuum'
+
+    @api.model
+    def power_on(self, *args, **kwargs):
+        self.env['muk_dms.lock']._garbage_collect()
+        self.env['muk_dms.upload']._garbage_collect()
+        self.env['muk_dms.rendition']._garbage_collect()
+        self.env['muk_dms.extraction']._garbage_collect()
+        return super(AutoVacuum, self).power_on(*args, **kwargs)
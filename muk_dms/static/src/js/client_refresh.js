@@ -27,8 +27,9 @@ var bus = require('bus.bus')
 WebClient.include({
     refresh: function(message) {
     	this._super(message);
+    	var model = _.isString(message) ? message : message.model;
     	var widget = this.action_manager.inner_widget;
-    	if((message === 'muk_dms.file' || message === 'muk_dms.directory') &&
+    	if((model === 'muk_dms.file' || model === 'muk_dms.directory') &&
     			widget && widget.name === "Documents") {
     		widget.refresh();
     	}
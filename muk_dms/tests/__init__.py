@@ -21,3 +21,9 @@
 
 from . import dms_case
 
+from . import test_size
+from . import test_lock
+from . import test_name
+from . import test_data
+from . import test_stream
+from . import test_upload
@@ -35,6 +35,24 @@ class DMSTestCase(common.TransactionCase):
     
     def setUp(self):
         super(DMSTestCase, self).setUp()
+        self.settings = self.env['muk_dms.settings'].create({
+            'name': "Test Settings",
+            'save_type': 'database'})
+        self.root = self.env['muk_dms.directory'].create({
+            'name': "Test Root",
+            'is_root_directory': True,
+            'settings': self.settings.id})
         
     def tearDown(self):
-        super(DMSTestCase, self).tearDown()
\ No newline at end of file
+        super(DMSTestCase, self).tearDown()
+    
+    def create_directory(self, name, parent=None):
+        return self.env['muk_dms.directory'].create({
+            'name': name,
+            'parent_directory': (parent or self.root).id})
+    
+    def create_file(self, name, content, directory=None):
+        return self.env['muk_dms.file'].create({
+            'name': name,
+            'directory': (directory or self.root).id,
+            'content': base64.b64encode(content)})
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import base64
+
+from odoo.addons.muk_dms.tests import dms_case
+
+class DataTestCase(dms_case.DMSTestCase):
+    
+    def test_dedupe(self):
+        first = self.create_file("a.txt", b"content")
+        second = self.create_file("b.txt", b"content")
+        self.assertEqual(first.reference, second.reference)
+        self.assertEqual(first.reference.reference_count, 2)
+        self.assertTrue(first.reference.checksum)
+    
+    def test_different_content(self):
+        first = self.create_file("a.txt", b"content")
+        second = self.create_file("b.txt", b"other content")
+        self.assertNotEqual(first.reference, second.reference)
+        self.assertEqual(first.reference.reference_count, 1)
+    
+    def test_release(self):
+        first = self.create_file("a.txt", b"content")
+        second = self.create_file("b.txt", b"content")
+        reference = first.reference
+        first.unlink()
+        self.assertEqual(reference.reference_count, 1)
+        self.assertEqual(base64.b64decode(second.content), b"content")
+        second.unlink()
+        self.assertFalse(reference.exists())
+    
+    def test_change_shared(self):
+        first = self.create_file("a.txt", b"content")
+        second = self.create_file("b.txt", b"content")
+        reference = first.reference
+        first.write({'content': base64.b64encode(b"changed")})
+        self.assertNotEqual(first.reference, reference)
+        self.assertEqual(reference.reference_count, 1)
+        self.assertEqual(base64.b64decode(first.content), b"changed")
+        self.assertEqual(base64.b64decode(second.content), b"content")
+    
+    def test_copy(self):
+        file = self.create_file("a.txt", b"content")
+        copy = file.copy()
+        self.assertEqual(copy.reference, file.reference)
+        self.assertEqual(file.reference.reference_count, 2)
+    
+    def test_copy_directory(self):
+        directory = self.create_directory("Source")
+        file = self.create_file("a.txt", b"content", directory)
+        copy = directory.copy()
+        self.assertEqual(copy.files.reference, file.reference)
+        self.assertEqual(file.reference.reference_count, 2)
+        self.assertEqual(copy.size, directory.size)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from odoo.exceptions import AccessError
+
+from odoo.addons.muk_dms.tests import dms_case
+
+class LockTestCase(dms_case.DMSTestCase):
+    
+    def test_lock(self):
+        file = self.create_file("a.txt", b"content")
+        file.lock(operation="first")
+        self.assertTrue(file.is_locked())
+        self.assertEqual(file.is_locked().operation, "first")
+    
+    def test_lock_conflict(self):
+        file = self.create_file("a.txt", b"content")
+        file.lock(operation="first")
+        with self.assertRaises(AccessError):
+            file.lock(operation="second")
+    
+    def test_lock_same_operation(self):
+        file = self.create_file("a.txt", b"content")
+        first = file.lock(operation="first")
+        second = file.lock(operation="first")
+        self.assertEqual(first[0]['lock'], second[0]['lock'])
+    
+    def test_lock_batch(self):
+        files = self.create_file("a.txt", b"a") | self.create_file("b.txt", b"b")
+        files[0].lock(operation="first")
+        with self.assertRaises(AccessError):
+            files.lock(operation="second")
+    
+    def test_write_locked(self):
+        file = self.create_file("a.txt", b"content")
+        file.lock(operation="first")
+        with self.assertRaises(AccessError):
+            file.with_context(operation="second").write({'name': "b.txt"})
+        file.with_context(operation="first").write({'name': "b.txt"})
+        self.assertEqual(file.name, "b.txt")
+    
+    def test_unlock(self):
+        file = self.create_file("a.txt", b"content")
+        file.lock(operation="first")
+        file.unlock()
+        self.assertFalse(file.is_locked())
+        file.lock(operation="second")
+        self.assertEqual(file.is_locked().operation, "second")
+    
+    def test_expired(self):
+        file = self.create_file("a.txt", b"content")
+        file.lock(operation="first")
+        self.env.cr.execute("""
+            UPDATE muk_dms_lock SET expiry = (now() at time zone 'UTC') - interval '1 second'
+            WHERE res_model = %s AND res_id = %s
+        """, (file._name, file.id))
+        self.env['muk_dms.lock'].invalidate_cache()
+        self.assertFalse(file.is_locked())
+        file.lock(operation="second")
+        self.assertEqual(file.is_locked().operation, "second")
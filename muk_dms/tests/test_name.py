@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import psycopg2
+
+from odoo.tools import mute_logger
+from odoo.exceptions import ValidationError
+
+from odoo.addons.muk_dms.tests import dms_case
+
+class NameTestCase(dms_case.DMSTestCase):
+    
+    @mute_logger('odoo.sql_db')
+    def test_file_names(self):
+        self.create_file("a.txt", b"content")
+        with self.assertRaises((ValidationError, psycopg2.IntegrityError)):
+            with self.env.cr.savepoint():
+                self.create_file("a.txt", b"content")
+    
+    @mute_logger('odoo.sql_db')
+    def test_directory_names(self):
+        self.create_directory("Documents")
+        with self.assertRaises((ValidationError, psycopg2.IntegrityError)):
+            with self.env.cr.savepoint():
+                self.create_directory("Documents")
+    
+    def test_names_per_directory(self):
+        first = self.create_directory("First")
+        second = self.create_directory("Second")
+        self.create_file("a.txt", b"content", first)
+        self.create_file("a.txt", b"content", second)
+        self.assertEqual(len(self.env['muk_dms.file'].search([('name', '=', "a.txt")])), 2)
+    
+    def test_invalid_names(self):
+        for name in ["", ".", "..", "a/b"]:
+            with self.assertRaises(ValidationError):
+                with self.env.cr.savepoint():
+                    self.create_file(name, b"content")
+    
+    def test_copy_name(self):
+        file = self.create_file("a.txt", b"content")
+        copy = file.copy()
+        self.assertNotEqual(copy.name, file.name)
+        self.assertEqual(copy.directory, file.directory)
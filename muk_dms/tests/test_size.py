@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from odoo.addons.muk_dms.tests import dms_case
+
+class SizeTestCase(dms_case.DMSTestCase):
+    
+    def test_create(self):
+        directory = self.create_directory("Sizes")
+        self.create_file("a.txt", b"x" * 10, directory)
+        self.create_file("b.txt", b"x" * 5, directory)
+        self.assertEqual(directory.size, 15)
+        self.assertEqual(self.root.size, 15)
+    
+    def test_write(self):
+        directory = self.create_directory("Sizes")
+        file = self.create_file("a.txt", b"x" * 10, directory)
+        file.write({'content': "eHh4"})
+        self.assertEqual(file.size, 3)
+        self.assertEqual(directory.size, 3)
+        self.assertEqual(self.root.size, 3)
+    
+    def test_move(self):
+        source = self.create_directory("Source")
+        target = self.create_directory("Target")
+        file = self.create_file("a.txt", b"x" * 10, source)
+        file.write({'directory': target.id})
+        self.assertEqual(source.size, 0)
+        self.assertEqual(target.size, 10)
+        self.assertEqual(self.root.size, 10)
+    
+    def test_unlink(self):
+        directory = self.create_directory("Sizes")
+        file = self.create_file("a.txt", b"x" * 10, directory)
+        self.create_file("b.txt", b"x" * 5, directory)
+        file.unlink()
+        self.assertEqual(directory.size, 5)
+        self.assertEqual(self.root.size, 5)
+    
+    def test_reconcile(self):
+        directory = self.create_directory("Sizes")
+        self.create_file("a.txt", b"x" * 10, directory)
+        self.env.cr.execute("UPDATE muk_dms_directory SET size = 0 WHERE id = %s", (directory.id,))
+        directory.invalidate_cache(['size'])
+        directory._reconcile_size()
+        self.assertEqual(directory.size, 10)
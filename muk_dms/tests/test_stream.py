@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import io
+import base64
+
+from odoo.addons.muk_dms.tests import dms_case
+
+class StreamTestCase(dms_case.DMSTestCase):
+    
+    def setUp(self):
+        super(StreamTestCase, self).setUp()
+        self.content = os.urandom(200000)
+        self.file = self.create_file("data.bin", self.content)
+    
+    def test_length(self):
+        self.assertEqual(self.file.reference._content_length(), len(self.content))
+        self.assertEqual(self.file.size, len(self.content))
+    
+    def test_stream(self):
+        with self.file.open_stream() as stream:
+            self.assertEqual(stream.read(), self.content)
+    
+    def test_seek(self):
+        with self.file.open_stream() as stream:
+            for start in [0, 1, 2, 3, 65535, 65536, 131073, len(self.content) - 1]:
+                stream.seek(start)
+                self.assertEqual(stream.read(1000), self.content[start:start + 1000])
+            self.assertEqual(stream.seek(-10, io.SEEK_END), len(self.content) - 10)
+            self.assertEqual(stream.read(), self.content[-10:])
+    
+    def test_ranges(self):
+        reference = self.file.reference
+        for start, end in [(0, 1), (1, 5), (100, 70000), (65536, 65537), (199990, 200000)]:
+            data = b"".join(reference._iter_content(start, end))
+            self.assertEqual(data, self.content[start:end])
+        self.assertEqual(b"".join(reference._iter_content()), self.content)
+    
+    def test_wrapped(self):
+        # content encoded with line breaks is stored without them
+        content = os.urandom(100000)
+        file = self.env['muk_dms.file'].create({
+            'name': "wrapped.bin",
+            'directory': self.root.id,
+            'content': base64.encodestring(content)})
+        with file.open_stream() as stream:
+            stream.seek(70001)
+            self.assertEqual(stream.read(100), content[70001:70101])
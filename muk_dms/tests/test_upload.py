@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import io
+import base64
+import hashlib
+
+from odoo.exceptions import ValidationError
+
+from odoo.addons.muk_dms.tests import dms_case
+from odoo.addons.muk_dms.models.dms_upload import UploadOffsetError
+
+class UploadTestCase(dms_case.DMSTestCase):
+    
+    def start(self, name, size):
+        upload = self.env['muk_dms.upload']._start(self.root.id, name, size)
+        self.addCleanup(upload._remove_file, upload._temp_path())
+        return upload
+    
+    def test_upload(self):
+        upload = self.start("a.txt", 7)
+        self.assertEqual(upload._append(0, io.BytesIO(b"content")), 7)
+        self.assertTrue(upload.file)
+        self.assertEqual(upload.file.name, "a.txt")
+        self.assertEqual(base64.b64decode(upload.file.content), b"content")
+        self.assertEqual(upload.file.reference.checksum, hashlib.sha1(b"content").hexdigest())
+    
+    def test_resume(self):
+        upload = self.start("a.txt", 7)
+        self.assertEqual(upload._append(0, io.BytesIO(b"con")), 3)
+        self.assertFalse(upload.file)
+        self.assertEqual(upload._find(upload.token), upload)
+        self.assertEqual(upload._append(3, io.BytesIO(b"tent")), 7)
+        self.assertEqual(base64.b64decode(upload.file.content), b"content")
+    
+    def test_offset_mismatch(self):
+        upload = self.start("a.txt", 7)
+        upload._append(0, io.BytesIO(b"con"))
+        with self.assertRaises(UploadOffsetError):
+            upload._append(5, io.BytesIO(b"nt"))
+        with self.assertRaises(UploadOffsetError):
+            upload._append(0, io.BytesIO(b"con"))
+        self.assertEqual(upload.received, 3)
+        upload._append(3, io.BytesIO(b"tent"))
+        self.assertEqual(base64.b64decode(upload.file.content), b"content")
+    
+    def test_finished(self):
+        upload = self.start("a.txt", 7)
+        upload._append(0, io.BytesIO(b"content"))
+        with self.assertRaises(UploadOffsetError):
+            upload._append(7, io.BytesIO(b""))
+    
+    def test_exceeds_size(self):
+        upload = self.start("a.txt", 3)
+        with self.assertRaises(ValidationError):
+            upload._append(0, io.BytesIO(b"content"))
+    
+    def test_existing_name(self):
+        self.create_file("a.txt", b"content")
+        with self.assertRaises(ValidationError):
+            self.start("a.txt", 7)
+    
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.start("a/b.txt", 7)
+        with self.assertRaises(ValidationError):
+            self.start("a.txt", -1)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+"""Text extractors for the content index.
+
+The module only depends on the standard library, since it is executed as a 
+separate process by the index, which applies time and memory limits to it:
+
+    python extract.py <mimetype> <path>
+
+The extracted text is written UTF-8 encoded to the standard output.
+"""
+
+import io
+import re
+import sys
+import email
+import zipfile
+import subprocess
+
+from xml.etree import cElementTree
+
+MAX_LENGTH = 1024 * 1024
+
+EXTRACTORS = {}
+
+def extractor(*mimetypes):
+    def register(function):
+        for mimetype in mimetypes:
+            EXTRACTORS[mimetype] = function
+        return function
+    return register
+
+def get_extractor(mimetype):
+    """Returns the extractor of the mimetype, with a fallback to the extractor
+    of the main type, such as text/*."""
+    if not mimetype:
+        return None
+    return EXTRACTORS.get(mimetype) or EXTRACTORS.get("%s/*" % mimetype.split('/')[0])
+
+def _words(data):
+    return "\n".join(re.findall(r"[^\x00-\x1F\x7F-\xFF]{4,}", data))
+
+def _xml_text(stream):
+    text = []
+    for event, element in cElementTree.iterparse(stream):
+        if element.text and element.text.strip():
+            text.append(element.text.strip())
+        element.clear()
+    return "\n".join(text)
+
+def _zip_text(path, pattern):
+    with zipfile.ZipFile(path) as archive:
+        return "\n".join(
+            _xml_text(archive.open(name)) for name in sorted(archive.namelist())
+            if re.match(pattern, name))
+
+@extractor('text/*')
+def extract_text(path):
+    with io.open(path, 'rb') as file:
+        return _words(file.read(MAX_LENGTH * 4))
+
+@extractor('application/pdf')
+def extract_pdf(path):
+    try:
+        return subprocess.check_output(['pdftotext', '-q', '-enc', 'UTF-8', path, '-'])
+    except OSError:
+        # pdftotext (poppler-utils) isn't installed
+        return ""
+
+@extractor('application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+def extract_docx(path):
+    return _zip_text(path, r"word/(document|header\d*|footer\d*)\.xml$")
+
+@extractor('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+def extract_xlsx(path):
+    return _zip_text(path, r"xl/sharedStrings\.xml$")
+
+@extractor('application/vnd.openxmlformats-officedocument.presentationml.presentation')
+def extract_pptx(path):
+    return _zip_text(path, r"ppt/slides/slide\d+\.xml$")
+
+@extractor(
+    'application/vnd.oasis.opendocument.text',
+    'application/vnd.oasis.opendocument.spreadsheet',
+    'application/vnd.oasis.opendocument.presentation')
+def extract_opendocument(path):
+    return _zip_text(path, r"content\.xml$")
+
+@extractor('message/rfc822')
+def extract_email(path):
+    with io.open(path, 'rb') as file:
+        message = email.message_from_file(file)
+    text = [message.get(header, "") for header in ('From', 'To', 'Cc', 'Subject')]
+    for part in message.walk():
+        if part.get_content_maintype() == 'text':
+            payload = part.get_payload(decode=True) or ""
+            charset = part.get_content_charset() or 'utf-8'
+            payload = payload.decode(charset, 'replace').encode('utf-8')
+            if part.get_content_subtype() == 'html':
+                payload = re.sub(r"<[^>]*>", " ", payload)
+            text.append(payload)
+    return "\n".join(text)
+
+def main(mimetype, path):
+    function = get_extractor(mimetype)
+    text = function(path) if function else ""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    sys.stdout.write(text[:MAX_LENGTH])
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
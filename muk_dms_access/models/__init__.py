@@ -24,4 +24,5 @@ from . import dms_directory
 from . import dms_file
 from . import dms_access_groups
 from . import hr_department
-from . import hr_job
\ No newline at end of file
+from . import hr_job
+from . import hr_employee
\ No newline at end of file
@@ -19,7 +19,7 @@
 #
 ###################################################################################
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 
 from odoo.addons.muk_dms.models import dms_base
 
@@ -102,8 +102,7 @@ class DocumentGroups(dms_base.DMSModel):
         'gid',
         'uid', 
         string='Users', 
-        compute='_compute_users', 
-        store=True)
+        readonly=True)
     
     files = fields.Many2many(
         'muk_dms.file',
@@ -135,6 +134,16 @@ class DocumentGroups(dms_base.DMSModel):
         ('name_uniq', 'unique (name)', 'The name of the group must be unique!')
     ]
     
+    @api.model_cr_context
+    def _auto_init(self):
+        result = super(DocumentGroups, self)._auto_init()
+        self._cr.execute("""
+            CREATE TABLE IF NOT EXISTS muk_dms_groups_version (
+                uid integer PRIMARY KEY REFERENCES res_users (id) ON DELETE CASCADE, 
+                version integer NOT NULL DEFAULT 0)
+        """)
+        return result
+    
     #----------------------------------------------------------
     # Functions
     #----------------------------------------------------------
@@ -150,37 +159,132 @@ class DocumentGroups(dms_base.DMSModel):
             
     def trigger_computation(self, fields, refresh=True, operation=None):
         super(DocumentGroups, self).trigger_computation(fields, refresh, operation)
-        values = {}
         if "users" in fields:
-            values.update(self.with_context(operation=operation)._compute_users(write=False))
-        if values:
-            self.write(values);   
-            if "users" in fields:
-                self.trigger_computation_down(fields, operation)
+            self._update_users()
+    
+    def _update_users(self, user_ids=None):
+        """Recomputes the members of the groups and their child groups in bulk.
+        The members of a group are the users of its additional users, of the 
+        managers and members of its departments and of the employees of its jobs, 
+        together with the members of its parent group. Only the differences are 
+        written. If users are given, only their memberships are recomputed."""
+        if not self or (user_ids is not None and not user_ids):
+            return
+        params = {'ids': tuple(self.ids), 'uids': tuple(user_ids or [0]), 'all': user_ids is None}
+        self.env.cr.execute("""
+            DROP TABLE IF EXISTS muk_dms_groups_lineage;
+            CREATE TEMP TABLE muk_dms_groups_lineage ON COMMIT DROP AS
+            SELECT DISTINCT g.id AS gid, p.id AS pid FROM muk_dms_access_groups g 
+            JOIN muk_dms_access_groups r 
+                ON g.parent_left >= r.parent_left AND g.parent_right <= r.parent_right
+            JOIN muk_dms_access_groups p 
+                ON p.parent_left <= g.parent_left AND p.parent_right >= g.parent_right
+            WHERE r.id IN %(ids)s;
+            
+            DROP TABLE IF EXISTS muk_dms_groups_members;
+            CREATE TEMP TABLE muk_dms_groups_members ON COMMIT DROP AS
+            SELECT * FROM (
+                SELECT l.gid, u.uid FROM muk_dms_groups_lineage l
+                JOIN muk_dms_groups_add_users_rel u ON u.gid = l.pid
+                UNION
+                SELECT l.gid, rr.user_id FROM muk_dms_groups_lineage l
+                JOIN muk_dms_groups_department_rel gd ON gd.gid = l.pid
+                JOIN hr_department d ON d.id = gd.did
+                JOIN hr_employee e ON e.id = d.manager_id
+                JOIN resource_resource rr ON rr.id = e.resource_id
+                UNION
+                SELECT l.gid, rr.user_id FROM muk_dms_groups_lineage l
+                JOIN muk_dms_groups_department_rel gd ON gd.gid = l.pid
+                JOIN hr_employee e ON e.department_id = gd.did
+                JOIN resource_resource rr ON rr.id = e.resource_id AND rr.active
+                UNION
+                SELECT l.gid, rr.user_id FROM muk_dms_groups_lineage l
+                JOIN muk_dms_groups_job_rel gj ON gj.gid = l.pid
+                JOIN hr_employee e ON e.job_id = gj.jid
+                JOIN resource_resource rr ON rr.id = e.resource_id AND rr.active
+            ) members
+            WHERE uid IS NOT NULL AND (%(all)s OR uid IN %(uids)s);
+            
+            DELETE FROM muk_dms_groups_users_rel c 
+            WHERE c.gid IN (SELECT DISTINCT gid FROM muk_dms_groups_lineage)
+            AND (%(all)s OR c.uid IN %(uids)s) AND NOT EXISTS (
+                SELECT 1 FROM muk_dms_groups_members m WHERE m.gid = c.gid AND m.uid = c.uid)
+            RETURNING c.uid;
+        """, params)
+        changed = set(row[0] for row in self.env.cr.fetchall())
+        self.env.cr.execute("""
+            INSERT INTO muk_dms_groups_users_rel (gid, uid)
+            SELECT m.gid, m.uid FROM muk_dms_groups_members m WHERE NOT EXISTS (
+                SELECT 1 FROM muk_dms_groups_users_rel c WHERE c.gid = m.gid AND c.uid = m.uid)
+            RETURNING uid
+        """)
+        changed |= set(row[0] for row in self.env.cr.fetchall())
+        if changed:
+            self.invalidate_cache(['users'])
+            self._invalidate_user_groups(changed)
+    
+    @api.model
+    def _update_users_hr(self, department_ids, job_ids, user_ids=None):
+        """Recomputes the memberships of the groups linked to the departments or jobs."""
+        groups = self.sudo().search(['|', 
+            ('departments', 'in', list(department_ids)), 
+            ('jobs', 'in', list(job_ids))])
+        groups._update_users(user_ids)
 
     #----------------------------------------------------------
     # Read, View 
     #----------------------------------------------------------
         
-    def _compute_users(self, write=True):
-        def get_users(record):
-            users = record.env['res.users']
-            if record.parent_group:
-                users |= record.parent_group._get_users()
-            employees = record.env['hr.employee']
-            employees += record.departments.manager_id
-            employees |= record.departments.member_ids
-            employees |= record.jobs.employee_ids
-            for employee in employees:
-                users += employee.user_id
-            users |= record.additional_users
-            return users
-        if write:
-            for record in self:
-                record.users = get_users(record)
-        else:
-            self.ensure_one()
-            return {'users': [(6, 0, get_users(self).mapped('id'))]}
+    @api.model
+    def _user_groups(self, uid):
+        """Returns the ids of the groups of the user, which grant each operation, 
+        and whether the user is a document administrator. The result is cached 
+        per process and version of the user. Changes to the members or permissions 
+        of groups increase the versions of the affected users, so that the other 
+        entries of the registry cache are kept. Changes to the user groups clear 
+        the caches through the access rules."""
+        self.env.cr.execute("SELECT version FROM muk_dms_groups_version WHERE uid = %s", (uid,))
+        version = self.env.cr.fetchone()
+        return self._user_groups_version(uid, version and version[0] or 0)
+    
+    @api.model
+    @tools.ormcache('uid', 'version')
+    def _user_groups_version(self, uid, version):
+        self.env.cr.execute("""
+            SELECT g.id, g.perm_create, g.perm_read, g.perm_write, g.perm_unlink, g.perm_access
+            FROM muk_dms_access_groups g JOIN muk_dms_groups_users_rel u ON u.gid = g.id
+            WHERE u.uid = %s
+        """, (uid,))
+        operations = ('create', 'read', 'write', 'unlink', 'access')
+        result = dict((operation, []) for operation in operations)
+        for row in self.env.cr.fetchall():
+            for operation, allowed in zip(operations, row[1:]):
+                if allowed:
+                    result[operation].append(row[0])
+        result = dict((operation, tuple(gids)) for operation, gids in result.items())
+        result['admin'] = self.env['res.users'].sudo(uid).has_group('muk_dms.group_dms_admin')
+        return result
+    
+    @api.model
+    def _invalidate_user_groups(self, user_ids):
+        """Increases the versions of the given users, which are visible to the
+        other workers once the transaction is committed."""
+        if user_ids:
+            self.env.cr.execute("""
+                INSERT INTO muk_dms_groups_version (uid, version)
+                SELECT DISTINCT u, 1 FROM unnest(%s::integer[]) AS u ORDER BY u
+                ON CONFLICT (uid) DO UPDATE SET version = muk_dms_groups_version.version + 1
+            """, (list(user_ids),))
+    
+    def _invalidate_members(self, subtree=False):
+        if self.ids:
+            self.env.cr.execute("""
+                SELECT DISTINCT u.uid FROM muk_dms_groups_users_rel u
+                JOIN muk_dms_access_groups g ON g.id = u.gid
+                JOIN muk_dms_access_groups r ON r.id IN %s AND (g.id = r.id OR (%s AND 
+                    g.parent_left > r.parent_left AND g.parent_right < r.parent_right))
+            """, (tuple(self.ids), subtree))
+            self._invalidate_user_groups([row[0] for row in self.env.cr.fetchall()])
     
     @api.depends('users')
     def _compute_count_users(self):
@@ -209,8 +313,16 @@ class DocumentGroups(dms_base.DMSModel):
     def _after_write_record(self, vals, operation):
         vals = super(DocumentGroups, self)._after_write_record(vals, operation)
         self._check_recomputation(vals, operation)
+        if any(field in vals for field in ['perm_create', 'perm_read', 
+                'perm_write', 'perm_unlink', 'perm_access']):
+            self._invalidate_members()
         return vals
     
+    def _before_unlink(self):
+        super(DocumentGroups, self)._before_unlink()
+        # the child groups are deleted as well
+        self._invalidate_members(subtree=True)
+    
     def _check_recomputation(self, values, operation=None):
         fields = []
         if any(field in values for field in ['parent_group', 'departments', 'jobs', 'additional_users']):
@@ -43,7 +43,7 @@ class DMSAdvancedAccessModel(dms_base.DMSAbstractModel):
     #----------------------------------------------------------
     
     perm_access = fields.Boolean(
-        compute='_compute_perm_access', 
+        compute='_compute_permissions', 
         string="Access")
     
     inherit_groups = fields.Boolean(
@@ -90,117 +90,106 @@ class DMSAdvancedAccessModel(dms_base.DMSAbstractModel):
     def check_access_rule(self, operation):
         if operation != 'access':
             super(DMSAdvancedAccessModel, self).check_access_rule(operation)
-        if self.env.user.id == SUPERUSER_ID or self.user_has_groups('muk_dms.group_dms_admin'):
+        if self._is_admin():
             return
+        ids = set(self.ids)
+        if ids and not ids <= self._eval_groups()[operation]:
+            raise AccessError(_("This operation is forbidden!"))
+    
+    def _eval_permissions(self, operations=('create', 'read', 'write', 'unlink', 'access')):
+        result = super(DMSAdvancedAccessModel, self)._eval_permissions(
+            [operation for operation in operations if operation != 'access'])
+        if 'access' in operations:
+            result['access'] = set(self.ids)
+        if self._is_admin():
+            return result
+        groups = self._eval_groups()
+        return dict((operation, ids & groups[operation]) for operation, ids in result.items())
+    
+    def _eval_groups(self):
+        """Returns the ids of the records for which the groups of the user grant 
+        each operation, evaluated with a single query for the whole recordset."""
+        user_groups = self.env['muk_dms_access.groups']._user_groups(self.env.user.id)
+        user_groups = dict((operation, gids) for operation, gids in user_groups.items() if operation != 'admin')
+        result = dict((operation, set()) for operation in user_groups)
+        gids = tuple(set(gid for operation_gids in user_groups.values() for gid in operation_gids))
+        if not self.ids or not gids:
+            return result
         base, model = self._name.split(".")
-        for record in self:
-            sql = '''
-                SELECT perm_%s                
-                FROM muk_groups_complete_%s_rel r
-                JOIN muk_dms_access_groups g ON g.id = r.gid
-                JOIN muk_dms_groups_users_rel u ON u.gid = g.id
-                WHERE r.aid = %s AND u.uid = %s
-            ''' % (operation, model, record.id, self.env.user.id)
-            self.env.cr.execute(sql)
-            fetch = self.env.cr.fetchall()
-            if not any(list(map(lambda x: x[0], fetch))):
-                raise AccessError(_("This operation is forbidden!"))
+        self.env.cr.execute("""
+            SELECT aid, gid FROM muk_groups_complete_{model}_rel 
+            WHERE aid IN %s AND gid IN %s
+        """.format(model=model), (tuple(self.ids), gids))
+        for aid, gid in self.env.cr.fetchall():
+            for operation, operation_gids in user_groups.items():
+                if gid in operation_gids:
+                    result[operation].add(aid)
+        return result
     
     @api.model
     def _apply_ir_rules(self, query, mode='read'):
         super(DMSAdvancedAccessModel, self)._apply_ir_rules(query, mode)
+    
+    def _is_admin(self, uid=None):
+        uid = uid or self.env.uid
+        return uid == SUPERUSER_ID or self.env['muk_dms_access.groups']._user_groups(uid)['admin']
+    
+    def _access_domain(self, operation='read', uid=None):
+        uid = uid or self.env.uid
+        if self._is_admin(uid):
+            return []
+        gids = self.env['muk_dms_access.groups']._user_groups(uid)[operation]
+        if not gids:
+            return [('id', 'in', [])]
+        base, model = self._name.split(".")
+        return [('id', 'inselect', ("""
+            SELECT aid FROM muk_groups_complete_{model}_rel WHERE gid IN %s
+        """.format(model=model), (gids,)))]
+    
+    @api.model
+    def _search(self, args, offset=0, limit=None, order=None, count=False, access_rights_uid=None):
+        args = list(args or []) + self._access_domain('read', access_rights_uid)
+        return super(DMSAdvancedAccessModel, self)._search(args, offset=offset, limit=limit,
+            order=order, count=count, access_rights_uid=access_rights_uid)
+        
+    @api.model
+    def read_group(self, domain, fields, groupby, offset=0, limit=None, orderby=False, lazy=True):
+        domain = list(domain or []) + self._access_domain('read')
+        return super(DMSAdvancedAccessModel, self).read_group(domain, fields, groupby, 
+            offset=offset, limit=limit, orderby=orderby, lazy=lazy)
         
     def _after_read(self, result):
         result = super(DMSAdvancedAccessModel, self)._after_read(result)
-        if self.env.user.id == SUPERUSER_ID or self.user_has_groups('muk_dms.group_dms_admin'):
+        if self._is_admin():
             return result
-        base, model = self._name.split(".")
-        sql = '''
-            SELECT r.aid
-            FROM muk_groups_complete_%s_rel r
-            JOIN muk_dms_access_groups g ON r.gid = g.id
-            JOIN muk_dms_groups_users_rel u ON r.gid = u.gid
-            WHERE u.uid = %s AND g.perm_read = true
-        ''' % (model, self.env.user.id)
-        self.env.cr.execute(sql)
-        fetch = self.env.cr.fetchall()
         result = [result] if not isinstance(result, list) else result
-        if len(fetch) > 0:
-            access_result = []
-            access_ids = list(map(lambda x: x[0], fetch))
-            for record in result:
-                if record['id'] in access_ids:
-                    access_result.append(record)
-            return access_result
-        return []
-    
-    def _after_search(self, result):
-        result = super(DMSAdvancedAccessModel, self)._after_search(result)
-        if self.env.user.id == SUPERUSER_ID or self.user_has_groups('muk_dms.group_dms_admin'):
-            return result
-        base, model = self._name.split(".")
-        sql = '''
-            SELECT r.aid
-            FROM muk_groups_complete_%s_rel r
-            JOIN muk_dms_access_groups g ON r.gid = g.id
-            JOIN muk_dms_groups_users_rel u ON r.gid = u.gid
-            WHERE u.uid = %s AND g.perm_read = true
-        ''' % (model, self.env.user.id)
-        self.env.cr.execute(sql)
-        fetch = self.env.cr.fetchall()
-        if len(fetch) > 0:
-            access_result = self.env[self._name]
-            access_ids = list(map(lambda x: x[0], fetch)) 
-            if isinstance(result, (int, long)):
-                if result in access_ids:
-                    return result
-            else:
-                for record in result:
-                    if record.id in access_ids:
-                        access_result += record
-                return access_result
-        return self.env[self._name]
-    
-    def _after_name_search(self, result):
-        result = super(DMSAdvancedAccessModel, self)._after_name_search(result)
-        if self.env.user.id == SUPERUSER_ID or self.user_has_groups('muk_dms.group_dms_admin'):
+        ids = [values['id'] for values in result]
+        if not ids:
             return result
+        gids = self.env['muk_dms_access.groups']._user_groups(self.env.user.id)['read']
+        if not gids:
+            return []
         base, model = self._name.split(".")
-        sql = '''
-            SELECT r.aid
-            FROM muk_groups_complete_%s_rel r
-            JOIN muk_dms_access_groups g ON r.gid = g.id
-            JOIN muk_dms_groups_users_rel u ON r.gid = u.gid
-            WHERE u.uid = %s AND g.perm_read = true
-        ''' % (model, self.env.user.id)
-        self.env.cr.execute(sql)
-        fetch = self.env.cr.fetchall()
-        if len(fetch) > 0:
-            access_result = []
-            access_ids = list(map(lambda x: x[0], fetch)) 
-            for tuple in result:
-                if tuple[0] in access_ids:
-                    access_result.append(tuple)
-            return access_result
-        return []
+        self.env.cr.execute("""
+            SELECT DISTINCT aid FROM muk_groups_complete_{model}_rel 
+            WHERE gid IN %s AND aid IN %s
+        """.format(model=model), (gids, tuple(ids)))
+        access_ids = set(row[0] for row in self.env.cr.fetchall())
+        return [values for values in result if values['id'] in access_ids]
     
     @api.model
     def check_field_access_rights(self, operation, fields):
         fields = super(DMSAdvancedAccessModel, self).check_field_access_rights(operation, fields)
-        if self.env.user.id == SUPERUSER_ID or self.user_has_groups('muk_dms.group_dms_admin'):
+        if self._is_admin():
             return fields
         if operation == 'write' and 'groups' in fields:
+            gids = self.env['muk_dms_access.groups']._user_groups(self.env.user.id)['access']
             base, model = self._name.split(".")
-            sql = '''
-                SELECT r.aid
-                FROM muk_groups_complete_%s_rel r
-                JOIN muk_dms_access_groups g ON r.gid = g.id
-                JOIN muk_dms_groups_users_rel u ON r.gid = u.gid
-                WHERE u.uid = %s AND g.perm_access = true
-            ''' % (model, self.env.user.id)
-            self.env.cr.execute(sql)
-            fetch = self.env.cr.fetchall()
-            if len(fetch) == 0:
+            if gids:
+                self.env.cr.execute("""
+                    SELECT 1 FROM muk_groups_complete_{model}_rel WHERE gid IN %s LIMIT 1
+                """.format(model=model), (gids,))
+            if not gids or not self.env.cr.fetchone():
                 raise AccessError(_("This operation is forbidden!"))
         return fields
         
@@ -208,13 +197,6 @@ class DMSAdvancedAccessModel(dms_base.DMSAbstractModel):
     # Read, View 
     #----------------------------------------------------------
         
-    @api.one
-    def _compute_perm_access(self):
-        try:
-            self.perm_access = self.check_access('access')
-        except AccessError:
-             self.perm_access = False
-    
     def _compute_groups(self, write=True):
         if write:
             for record in self:
@@ -36,32 +36,52 @@ class AccessDirectory(dms_base.DMSModel):
     
     def trigger_computation(self, fields, refresh=True, operation=None):
         super(AccessDirectory, self).trigger_computation(fields, refresh, operation)
-        values = {}
         if "complete_groups" in fields:
-            values.update(self.with_context(operation=operation)._compute_groups(write=False))
-        if values:
-            self.write(values);   
-            if "complete_groups" in fields:
-                self.trigger_computation_down(fields, operation)
+            self._update_complete_groups()
     
-    #----------------------------------------------------------
-    # Read, View 
-    #----------------------------------------------------------
+    def _update_complete_groups(self):
+        """Recomputes the complete groups of the subtrees in bulk. A directory gets
+        its own groups and, as long as it inherits them, those of its parent. Hence
+        its complete groups are the groups of its ancestors up to the nearest one,
+        which doesn't inherit groups. Only the differences are written."""
+        if not self:
+            return
+        self.env.cr.execute("""
+            DROP TABLE IF EXISTS muk_dms_groups_subtree;
+            CREATE TEMP TABLE muk_dms_groups_subtree ON COMMIT DROP AS
+            SELECT DISTINCT d.id, d.parent_left, d.parent_right, (
+                SELECT b.parent_left FROM muk_dms_directory b
+                WHERE b.parent_left <= d.parent_left AND b.parent_right >= d.parent_right
+                AND (b.inherit_groups IS NOT TRUE OR b.parent_directory IS NULL)
+                ORDER BY b.parent_left DESC LIMIT 1) AS bound
+            FROM muk_dms_directory d JOIN muk_dms_directory r 
+            ON d.parent_left >= r.parent_left AND d.parent_right <= r.parent_right
+            WHERE r.id IN %s;
+            
+            DROP TABLE IF EXISTS muk_dms_groups_complete;
+            CREATE TEMP TABLE muk_dms_groups_complete ON COMMIT DROP AS
+            SELECT DISTINCT s.id AS aid, g.gid FROM muk_dms_groups_subtree s
+            JOIN muk_dms_directory a ON a.parent_left <= s.parent_left 
+                AND a.parent_right >= s.parent_right AND a.parent_left >= s.bound
+            JOIN muk_groups_directory_rel g ON g.aid = a.id;
+            
+            DELETE FROM muk_groups_complete_directory_rel c USING muk_dms_groups_subtree s
+            WHERE c.aid = s.id AND NOT EXISTS (
+                SELECT 1 FROM muk_dms_groups_complete e WHERE e.aid = c.aid AND e.gid = c.gid);
+            
+            INSERT INTO muk_groups_complete_directory_rel (aid, gid)
+            SELECT e.aid, e.gid FROM muk_dms_groups_complete e WHERE NOT EXISTS (
+                SELECT 1 FROM muk_groups_complete_directory_rel c WHERE c.aid = e.aid AND c.gid = e.gid);
+        """, (tuple(self.ids),))
+        self.invalidate_cache(['complete_groups'])
+        self.env['muk_dms.file']._update_complete_groups_query("""
+            SELECT f.id FROM muk_dms_file f JOIN muk_dms_groups_subtree s ON f.directory = s.id
+        """)
+    
+    def _copy_subtree(self, directory, operation=None):
+        super(AccessDirectory, self)._copy_subtree(directory, operation)
+        directory.trigger_computation(['complete_groups'])
     
-    def _compute_groups(self, write=True):
-        def get_groups(record):
-            groups = record.env['muk_dms_access.groups']
-            if record.parent_directory and record.inherit_groups:
-                groups |= record.parent_directory.complete_groups
-            groups |= record.groups
-            return groups
-        if write:
-            for record in self:
-                record.users = get_groups(record)
-        else:
-            self.ensure_one()
-            return {'complete_groups': [(6, 0, get_groups(self).mapped('id'))]}
-        
     #----------------------------------------------------------
     # Create, Write 
     #----------------------------------------------------------
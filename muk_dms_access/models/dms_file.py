@@ -36,30 +36,40 @@ class AccessFile(dms_base.DMSModel):
     
     def trigger_computation(self, fields, refresh=True, operation=None):
         super(AccessFile, self).trigger_computation(fields, refresh, operation)
-        values = {}
         if "complete_groups" in fields:
-            values.update(self.with_context(operation=operation)._compute_groups(write=False))
-        if values:
-            self.write(values);   
+            self._update_complete_groups_query("SELECT unnest(%s)", (self.ids,))
     
-    #----------------------------------------------------------
-    # Read, View 
-    #----------------------------------------------------------
+    @api.model
+    def _update_complete_groups_query(self, query, params=None):
+        """Recomputes the complete groups of the files returned by the query in bulk.
+        The complete groups of a file are its own groups and, if it inherits them, 
+        the complete groups of its directory. Only the differences are written."""
+        self.env.cr.execute("""
+            DROP TABLE IF EXISTS muk_dms_groups_files;
+            CREATE TEMP TABLE muk_dms_groups_files ON COMMIT DROP AS
+            SELECT DISTINCT q.id FROM ({query}) q(id);
+            
+            DROP TABLE IF EXISTS muk_dms_groups_complete_files;
+            CREATE TEMP TABLE muk_dms_groups_complete_files ON COMMIT DROP AS
+            SELECT g.aid, g.gid FROM muk_groups_file_rel g 
+            JOIN muk_dms_groups_files q ON g.aid = q.id
+            UNION
+            SELECT f.id, c.gid FROM muk_dms_file f 
+            JOIN muk_dms_groups_files q ON f.id = q.id
+            JOIN muk_groups_complete_directory_rel c ON c.aid = f.directory
+            WHERE f.inherit_groups;
+            
+            DELETE FROM muk_groups_complete_file_rel c USING muk_dms_groups_files q
+            WHERE c.aid = q.id AND NOT EXISTS (
+                SELECT 1 FROM muk_dms_groups_complete_files e WHERE e.aid = c.aid AND e.gid = c.gid);
+            
+            INSERT INTO muk_groups_complete_file_rel (aid, gid)
+            SELECT e.aid, e.gid FROM muk_dms_groups_complete_files e WHERE NOT EXISTS (
+                SELECT 1 FROM muk_groups_complete_file_rel c WHERE c.aid = e.aid AND c.gid = e.gid);
+        """.format(query=query), params)
+        self.invalidate_cache(['complete_groups'])
+        self.env['muk_dms_access.groups'].invalidate_cache(['files', 'directories'])
     
-    def _compute_groups(self, write=True):
-        def get_groups(record):
-            groups = record.env['muk_dms_access.groups']
-            if record.inherit_groups:
-                groups |= record.directory.complete_groups
-            groups |= record.groups
-            return groups
-        if write:
-            for record in self:
-                record.users = get_groups(record)
-        else:
-            self.ensure_one()
-            return {'complete_groups': [(6, 0, get_groups(self).mapped('id'))]}
-        
     #----------------------------------------------------------
     # Create, Write 
     #----------------------------------------------------------
@@ -49,18 +49,13 @@ class DocumentDepartment(models.Model):
     @api.multi
     def write(self, vals):
         result = super(DocumentDepartment, self).write(vals)
-        if any(field in vals for field in ['parent_id', 'jobs_ids', 'manager_id', 'member_ids']):
-            for record in self:
-                for group in record.groups:
-                    group.trigger_computation(['users'])
+        if any(field in vals for field in ['manager_id', 'member_ids']):
+            self.env['muk_dms_access.groups']._update_users_hr(self.ids, [])
         return result
     
     @api.multi
     def unlink(self):
-        groups = record.env['muk_dms_access.groups']
-        for record in self:
-            groups |= record.groups
+        groups = self.sudo().mapped('groups')
         result = super(DocumentDepartment, self).unlink()
-        for group in groups:
-            group.trigger_computation(['users'])
-        return result
\ No newline at end of file
+        groups.exists()._update_users()
+        return result
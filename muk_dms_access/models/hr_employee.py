@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+import logging
+
+from odoo import api, fields, models
+from odoo import tools, _
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+class DocumentEmployee(models.Model):
+
+    _inherit = 'hr.employee'
+    
+    #----------------------------------------------------------
+    # Functions
+    #----------------------------------------------------------
+    
+    def _access_group_refs(self):
+        """Returns the departments, jobs and users, which link the employees to
+        access groups."""
+        employees = self.sudo().with_context(active_test=False)
+        departments = employees.mapped('department_id')
+        departments |= self.env['hr.department'].sudo().search([('manager_id', 'in', self.ids)])
+        return (set(departments.ids), set(employees.mapped('job_id').ids), 
+            set(employees.mapped('user_id').ids))
+    
+    def _update_access_groups(self, refs):
+        departments, jobs, users = refs
+        if (departments or jobs) and users:
+            self.env['muk_dms_access.groups']._update_users_hr(departments, jobs, users)
+    
+    #----------------------------------------------------------
+    # Create, Update, Delete
+    #----------------------------------------------------------
+    
+    @api.model
+    def create(self, vals):
+        record = super(DocumentEmployee, self).create(vals)
+        record._update_access_groups(record._access_group_refs())
+        return record
+    
+    @api.multi
+    def write(self, vals):
+        if not any(field in vals for field in ['department_id', 'job_id', 'user_id', 'active']):
+            return super(DocumentEmployee, self).write(vals)
+        before = self._access_group_refs()
+        result = super(DocumentEmployee, self).write(vals)
+        after = self._access_group_refs()
+        self._update_access_groups(tuple(old | new for old, new in zip(before, after)))
+        return result
+    
+    @api.multi
+    def unlink(self):
+        refs = self._access_group_refs()
+        result = super(DocumentEmployee, self).unlink()
+        self._update_access_groups(refs)
+        return result
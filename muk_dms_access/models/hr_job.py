@@ -48,19 +48,14 @@ class DocumentJob(models.Model):
     
     @api.multi
     def write(self, vals):
-        result = super(DocumentDepartment, self).write(vals)
-        if any(field in vals for field in ['employee_ids', 'department_id']):
-            for record in self:
-                for group in record.groups:
-                    group.trigger_computation(['users'])
+        result = super(DocumentJob, self).write(vals)
+        if 'employee_ids' in vals:
+            self.env['muk_dms_access.groups']._update_users_hr([], self.ids)
         return result
     
     @api.multi
     def unlink(self):
-        groups = record.env['muk_dms_access.groups']
-        for record in self:
-            groups |= record.groups
-        result = super(DocumentDepartment, self).unlink()
-        for group in groups:
-            group.trigger_computation(['users'])
-        return result
\ No newline at end of file
+        groups = self.sudo().mapped('groups')
+        result = super(DocumentJob, self).unlink()
+        groups.exists()._update_users()
+        return result
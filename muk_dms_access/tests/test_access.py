@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from odoo.addons.muk_dms.tests import dms_case
+
+class AccessTestCase(dms_case.DMSTestCase):
+    
+    def setUp(self):
+        super(AccessTestCase, self).setUp()
+        self.user = self.create_user("dms_access_user", 'muk_dms.group_dms_user')
+        self.admin = self.create_user("dms_access_admin", 'muk_dms.group_dms_admin')
+        self.group = self.env['muk_dms_access.groups'].create({
+            'name': "Readers",
+            'perm_read': True,
+            'additional_users': [(6, 0, [self.user.id])]})
+        self.other_group = self.env['muk_dms_access.groups'].create({
+            'name': "Others",
+            'perm_read': True})
+        self.public = self.create_directory("Public")
+        self.public.write({'groups': [(6, 0, [self.group.id])]})
+        self.private = self.create_directory("Private")
+        self.private.write({'groups': [(6, 0, [self.other_group.id])]})
+        self.public_file = self.create_file("public.txt", b"public", self.public)
+        self.private_file = self.create_file("private.txt", b"private", self.private)
+        self.directories = self.public | self.private
+        self.files = self.public_file | self.private_file
+    
+    def create_user(self, login, group):
+        return self.env['res.users'].create({
+            'name': login,
+            'login': login,
+            'groups_id': [(6, 0, [self.ref('base.group_user'), self.ref(group)])]})
+    
+    def test_search(self):
+        directories = self.env['muk_dms.directory'].sudo(self.user)
+        files = self.env['muk_dms.file'].sudo(self.user)
+        self.assertEqual(directories.search([('id', 'in', self.directories.ids)]).ids, self.public.ids)
+        self.assertEqual(files.search([('id', 'in', self.files.ids)]).ids, self.public_file.ids)
+        self.assertEqual(files.search_count([('id', 'in', self.files.ids)]), 1)
+    
+    def test_search_admin(self):
+        files = self.env['muk_dms.file'].sudo(self.admin)
+        self.assertEqual(set(files.search([('id', 'in', self.files.ids)]).ids), set(self.files.ids))
+    
+    def test_read_group(self):
+        files = self.env['muk_dms.file'].sudo(self.user)
+        groups = files.read_group([('id', 'in', self.files.ids)], ['directory'], ['directory'])
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0]['directory'][0], self.public.id)
+        self.assertEqual(groups[0]['directory_count'], 1)
+    
+    def test_read_group_admin(self):
+        files = self.env['muk_dms.file'].sudo(self.admin)
+        groups = files.read_group([('id', 'in', self.files.ids)], ['directory'], ['directory'])
+        self.assertEqual(len(groups), 2)
+    
+    def test_inherited(self):
+        directory = self.create_directory("Subdirectory", self.public)
+        file = self.create_file("sub.txt", b"sub", directory)
+        files = self.env['muk_dms.file'].sudo(self.user)
+        self.assertEqual(files.search([('id', '=', file.id)]).ids, file.ids)
+    
+    def test_membership(self):
+        files = self.env['muk_dms.file'].sudo(self.user)
+        self.assertEqual(files.search([('id', 'in', self.files.ids)]).ids, self.public_file.ids)
+        self.group.write({'additional_users': [(5, 0, 0)]})
+        self.other_group.write({'additional_users': [(6, 0, [self.user.id])]})
+        self.assertEqual(files.search([('id', 'in', self.files.ids)]).ids, self.private_file.ids)
+    
+    def test_permissions(self):
+        files = self.env['muk_dms.file'].sudo(self.user)
+        self.group.write({'perm_read': False})
+        self.assertFalse(files.search([('id', 'in', self.files.ids)]))
@@ -20,5 +20,6 @@
 ###################################################################################
 
 from . import dms_settings
+from . import dms_directory
 from . import dms_file
 from . import dms_data
\ No newline at end of file
@@ -19,7 +19,9 @@
 #
 ###################################################################################
 
+import io
 import os
+import mmap
 import errno
 import shutil
 import base64
@@ -33,12 +35,49 @@ from odoo import models, api, fields
 from odoo.tools import config, human_size, ustr, html_escape
 from odoo.exceptions import ValidationError, AccessError, MissingError
 
+
 _logger = logging.getLogger(__name__)
 
+BLOB_PATH = "/.blobs/"
+
 #----------------------------------------------------------
 # Static Functions
 #----------------------------------------------------------
 
+class MappedStream(io.RawIOBase):
+    """Seekable reader on a memory-mapped file."""
+    
+    def __init__(self, mapped):
+        super(MappedStream, self).__init__()
+        self._mapped = mapped
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._mapped.tell()
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._mapped.tell()
+        elif whence == io.SEEK_END:
+            offset += self._mapped.size()
+        self._mapped.seek(min(max(offset, 0), self._mapped.size()))
+        return self._mapped.tell()
+    
+    def readinto(self, buffer):
+        data = self._mapped.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def close(self):
+        if not self.closed:
+            self._mapped.close()
+        super(MappedStream, self).close()
+
 @contextmanager
 def opened_w_error(filename, mode="r"):
     try:
@@ -71,10 +110,6 @@ class SystemFileDataModel(models.Model):
     dms_path = fields.Char(
         string="Document Path")
     
-    checksum = fields.Char(
-        string="Checksum",
-        readonly=True)
-    
     #----------------------------------------------------------
     # Abstract Implementation
     #----------------------------------------------------------
@@ -92,11 +127,9 @@ class SystemFileDataModel(models.Model):
     
     def update(self, values):
         if 'content' in values:
-            file = base64.decodestring(values['content'])
-            file_path = self._build_path()
-            self._ensure_dir(file_path)
-            self.checksum = self._compute_checksum(file)
-            self._write_file(file_path, file)
+            # data objects are addressed by their checksum and shared between files,
+            # new content has to be stored as a new data object by _store instead
+            raise ValidationError(_("The content of a stored file can't be changed."))
         elif 'base_path' in values:
             old_file_path = self._build_path()
             new_file_path = self._build_path(base_path=values['base_path'], dms_path=self.dms_path)
@@ -104,7 +137,7 @@ class SystemFileDataModel(models.Model):
             self._move_file(old_file_path, new_file_path)
             self._remove_empty_directories(old_file_path)
             self.base_path = values['base_path']
-        elif 'dms_path' in values:
+        elif 'dms_path' in values and not self._is_blob():
             old_file_path = self._build_path()
             new_file_path = self._build_path(base_path=self.base_path, dms_path=values['dms_path'])
             self._ensure_dir(new_file_path)
@@ -113,25 +146,196 @@ class SystemFileDataModel(models.Model):
             self.dms_path = values['dms_path']
     
     def delete(self):
+        if self._is_blob() and self.search_count([
+                ('base_path', '=', self.base_path), ('dms_path', '=', self.dms_path),
+                ('id', '!=', self.id)]):
+            return
+        file_path = self._build_path()
+        base_path, dms_path, is_blob = self.base_path, self.dms_path, self._is_blob()
+        # the file is removed once the deletion of the record has been committed,
+        # otherwise a rollback would restore a record without its content
+        self.env.cr.after('commit', lambda: self._delete_committed(file_path, base_path, dms_path, is_blob))
+    
+    def _delete_committed(self, file_path, base_path, dms_path, is_blob):
+        if not is_blob:
+            return self._delete_path(file_path)
+        # blobs which are stored by a pending transaction are kept, the lock is 
+        # released explicitly since the cursor might be used further
+        checksum = os.path.basename(dms_path)
+        self.env.cr.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", (self._blob_key(), checksum))
+        if not self.env.cr.fetchone()[0]:
+            return
+        try:
+            # the content might have been stored again in the meantime
+            self.env.cr.execute("""
+                SELECT 1 FROM muk_dms_data_system WHERE base_path = %s AND dms_path = %s LIMIT 1
+            """, (base_path, dms_path))
+            if not self.env.cr.fetchone():
+                self._delete_path(file_path)
+        finally:
+            self.env.cr.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (self._blob_key(), checksum))
+    
+    def _delete_path(self, file_path):
+        try:
+            self._delete_file(file_path)
+            self._remove_empty_directories(file_path)
+        except AccessError:
+            _logger.warning("The file (%s) has been left in the file system." % file_path)
+    
+    def _content_length(self):
+        return self._read_size(self._build_path())
+    
+    def open_stream(self):
+        self.ensure_one()
         file_path = self._build_path()
-        self._delete_file(file_path)
-        self._remove_empty_directories(file_path)
+        with opened_w_error(file_path, "rb") as (file_handler, exc):
+            if exc:
+                _logger.error("Failed to read the file (%s): %s" % (file_path, str(exc)))
+                raise MissingError(_("Something went wrong! Seems that the file is missing or is broken."))
+            if not os.fstat(file_handler.fileno()).st_size:
+                return io.BytesIO()
+            return MappedStream(mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ))
     
     def update_checksum(self):
         for record in self:
             file_path = record._build_path()
-            with opened_w_error(file_path, "rb") as (file_handler, exc):
-                if exc:
-                    _logger.error("Failed to read the file: " + str(exc))
-                    raise MissingError(_("Something went wrong! Seems that the file is missing."))
-                else:
-                    file = file_handler.read()
-                    record.checksum = record._compute_checksum(file)
+            try:
+                record.checksum = record._compute_checksum_path(file_path)
+            except IOError as exc:
+                _logger.error("Failed to read the file: " + str(exc))
+                raise MissingError(_("Something went wrong! Seems that the file is missing."))
+    
+    #----------------------------------------------------------
+    # Content Addressing
+    #----------------------------------------------------------
+    
+    @api.model
+    def _store(self, base_path, content):
+        """Returns a data object with the given content, which is shared with
+        other files of the same content and base path if possible. New files
+        are stored under their checksum in the blob directory and removed again
+        if the transaction is rolled back."""
+        file = base64.b64decode(content or "")
+        checksum = self._compute_checksum(file)
+        dms_path = self._blob_path(checksum)
+        self._lock_blob(checksum)
+        reference = self._dedupe(checksum, {'base_path': base_path, 'dms_path': dms_path})
+        if not reference:
+            reference = self.create({'base_path': base_path, 'dms_path': dms_path, 'checksum': checksum})
+            file_path = reference._build_path()
+            reference._ensure_dir(file_path)
+            reference._write_file(file_path, file)
+            self.env.cr.after('rollback', lambda: self._delete_committed(file_path, base_path, dms_path, True))
+        return reference
+    
+    @api.model
+    def _store_path(self, base_path, file_path, checksum=None):
+        """Returns a data object with the content of the given file. Unless the
+        content is already stored, the file is moved into the blob directory.
+        The move is reverted if the transaction is rolled back."""
+        checksum = checksum or self._compute_checksum_path(file_path)
+        dms_path = self._blob_path(checksum)
+        self._lock_blob(checksum)
+        reference = self._dedupe(checksum, {'base_path': base_path, 'dms_path': dms_path})
+        if not reference:
+            reference = self.create({'base_path': base_path, 'dms_path': dms_path, 'checksum': checksum})
+            blob_path = reference._build_path()
+            reference._ensure_dir(blob_path)
+            reference._move_file(file_path, blob_path)
+            self.env.cr.after('rollback', lambda: shutil.move(blob_path, file_path))
+        return reference
+    
+    def _blob_key(self):
+        return self.env['muk_dms.lock']._advisory_key(self._name)
+    
+    def _lock_blob(self, checksum):
+        """Locks the blob of the checksum shared until the end of the transaction,
+        so that it isn't removed by a concurrent deletion while it is stored."""
+        self.env.cr.execute("SELECT pg_advisory_xact_lock_shared(%s, hashtext(%s))", (self._blob_key(), checksum))
+    
+    def _blob_path(self, checksum):
+        return "%s%s/%s" % (BLOB_PATH, checksum[:2], checksum)
+    
+    def _is_blob(self):
+        return bool(self.dms_path and self.dms_path.startswith(BLOB_PATH))
+    
+    def _share(self):
+        # files stored under the path of their document can't be shared
+        if not all(record._is_blob() for record in self):
+            return False
+        return super(SystemFileDataModel, self)._share()
+    
+    def _shared_condition(self):
+        return "data.dms_path LIKE '%s%%%%'" % BLOB_PATH
+    
+    @api.model
+    def _copy_references(self, table):
+        super(SystemFileDataModel, self)._copy_references(table)
+        self.env.cr.execute("""
+            WITH source AS (
+                SELECT f.id AS file, nextval('muk_dms_data_system_id_seq')::integer AS id,
+                    data.base_path AS old_base_path, data.dms_path AS old_dms_path,
+                    COALESCE(s.base_path, data.base_path) AS base_path, f.path AS dms_path,
+                    data.checksum AS checksum
+                FROM muk_dms_file f
+                JOIN {table} copy ON copy.new_id = f.id
+                JOIN muk_dms_data_system data ON data.id = split_part(f.reference, ',', 2)::integer
+                LEFT JOIN muk_dms_settings s ON s.id = f.settings AND s.save_type = 'file'
+                WHERE split_part(f.reference, ',', 1) = %(model)s
+                AND data.dms_path NOT LIKE %(blobs)s
+            ), data AS (
+                INSERT INTO muk_dms_data_system (id, base_path, dms_path, checksum, reference_count,
+                    create_uid, create_date, write_uid, write_date)
+                SELECT id, base_path, dms_path, checksum, 1, 
+                    %(uid)s, (now() at time zone 'UTC'), %(uid)s, (now() at time zone 'UTC')
+                FROM source
+            )
+            UPDATE muk_dms_file f SET reference = %(model)s || ',' || source.id
+            FROM source WHERE f.id = source.file
+            RETURNING source.old_base_path, source.old_dms_path, source.base_path, source.dms_path
+        """.format(table=table), {'model': self._name, 'uid': self.env.uid, 'blobs': BLOB_PATH + '%'})
+        for old_base_path, old_dms_path, base_path, dms_path in self.env.cr.fetchall():
+            new_file_path = self._build_path(base_path=base_path, dms_path=dms_path)
+            self._ensure_dir(new_file_path)
+            self._copy_file(self._build_path(base_path=old_base_path, dms_path=old_dms_path), new_file_path)
+    
+    def _move_tree(self, base_path, old_path, path):
+        old_tree_path = self._build_path(base_path=base_path, dms_path=old_path)
+        new_tree_path = self._build_path(base_path=base_path, dms_path=path)
+        if os.path.isdir(old_tree_path) and not os.path.exists(new_tree_path):
+            self._ensure_dir(new_tree_path)
+            self._move_file(old_tree_path, new_tree_path)
+            self._remove_empty_directories(old_tree_path)
+            self.env.cr.after('rollback', lambda: self._move_back(new_tree_path, old_tree_path))
+        else:
+            for record in self:
+                old_file_path = record._build_path()
+                new_file_path = record._build_path(dms_path=path + record.dms_path[len(old_path):])
+                record._ensure_dir(new_file_path)
+                record._move_file(old_file_path, new_file_path)
+                record._remove_empty_directories(old_file_path)
+                self.env.cr.after('rollback', lambda old_file_path=old_file_path, new_file_path=new_file_path: 
+                    self._move_back(new_file_path, old_file_path))
+        self.env.cr.execute("""
+            UPDATE muk_dms_data_system SET dms_path = %s || substr(dms_path, length(%s) + 1)
+            WHERE id IN %s
+        """, (path, old_path, tuple(self.ids)))
+        self.invalidate_cache(['dms_path'], self.ids)
     
     #----------------------------------------------------------
     # File Helper
     #----------------------------------------------------------
     
+    def _move_back(self, new_path, old_path):
+        # reverts a move of the file system if the transaction is rolled back
+        try:
+            if not os.path.exists(os.path.dirname(old_path)):
+                os.makedirs(os.path.dirname(old_path))
+            shutil.move(new_path, old_path)
+            self._remove_empty_directories(new_path)
+        except (IOError, OSError, AccessError):
+            _logger.error("Failed to move back (%s) to (%s) after a rollback." % (new_path, old_path))
+    
     def _build_path(self, base_path=None, dms_path=None):
         base_path = (base_path or self.base_path)
         dms_path = (dms_path or self.dms_path)
@@ -146,9 +350,6 @@ class SystemFileDataModel(models.Model):
                     _logger.error("Failed to create the necessary directories: " + str(exc))
                     raise AccessError(_("The System failed to create the necessary directories."))
     
-    def _compute_checksum(self, file):
-        return hashlib.sha1(file).hexdigest()
-    
     def _check_file(self, file, checksum):
         return hashlib.sha1(file).hexdigest() == checksum
     
@@ -179,6 +380,17 @@ class SystemFileDataModel(models.Model):
                 _logger.error("Failed to move the file: " + str(exc))
                 raise AccessError(_("The System failed to rename the file."))
     
+    def _copy_file(self, old_file_path, new_file_path):
+        try:
+            shutil.copyfile(old_file_path, new_file_path)
+        except IOError as exc:
+            if exc.errno == errno.ENOENT:
+                _logger.error("Failed to copy the file: " + str(exc))
+                raise MissingError(_("Something went wrong! Seems that the file is missing."))
+            else:
+                _logger.error("Failed to copy the file: " + str(exc))
+                raise AccessError(_("The System failed to copy the file."))
+    
     def _read_file(self, file_path):
         with opened_w_error(file_path, "rb") as (file_handler, exc):
             if exc:
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+###################################################################################
+# 
+#    Copyright (C) 2017 MuK IT GmbH
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###################################################################################
+
+import logging
+
+from odoo import _
+from odoo import models, api, fields
+
+from odoo.addons.muk_dms.models import dms_base
+
+_logger = logging.getLogger(__name__)
+
+class SystemDirectory(dms_base.DMSModel):
+    _inherit = 'muk_dms.directory'
+    
+    #----------------------------------------------------------
+    # Subtree
+    #----------------------------------------------------------
+    
+    def _update_subtree_references(self, left, right, old_path, path):
+        super(SystemDirectory, self)._update_subtree_references(left, right, old_path, path)
+        self.env.cr.execute("""
+            SELECT s.base_path, array_agg(s.id) FROM muk_dms_data_system s
+            JOIN muk_dms_file f ON f.reference = 'muk_dms.data_system,' || s.id
+            JOIN muk_dms_directory d ON f.directory = d.id
+            WHERE d.parent_left >= %s AND d.parent_right <= %s
+            AND left(s.dms_path, length(%s)) = %s
+            GROUP BY s.base_path
+        """, (left, right, old_path, old_path))
+        for base_path, ids in self.env.cr.fetchall():
+            references = self.env['muk_dms.data_system'].sudo().browse(ids)
+            references._move_tree(base_path, old_path, path)
@@ -57,11 +57,15 @@ class SystemFile(dms_base.DMSModel):
         if result:
             return result
         if settings.save_type == 'file':
-            reference = self.env['muk_dms.data_system'].sudo().create(
-                {'base_path': settings.base_path,
-                 'dms_path': os.path.join(path, filename)})
-            reference.sudo().update({'content': content})
-            return reference
+            return self.env['muk_dms.data_system'].sudo()._store(settings.base_path, content)
+        return None
+
+    def _create_reference_from_path(self, settings, file_path, checksum=None):
+        result = super(SystemFile, self)._create_reference_from_path(settings, file_path, checksum)
+        if result:
+            return result
+        if settings.save_type == 'file':
+            return self.env['muk_dms.data_system'].sudo()._store_path(settings.base_path, file_path, checksum)
         return None
 
     def _check_reference_values(self, values):
@@ -31,10 +31,11 @@ WebClient.include({
         return this._super();
     },
     refresh: function(message) {
+    	var model = _.isString(message) ? message : message.model;
     	var active_view = this.action_manager.inner_widget.active_view
         if (active_view){   
             var controller = this.action_manager.inner_widget.active_view.controller
-            if (controller.model === message  && !controller.$el.hasClass('o_form_editable')){                                               
+            if (controller.model === model  && !controller.$el.hasClass('o_form_editable')){                                               
                 if (active_view.type === "kanban")
                     controller.do_reload();
                 if (active_view.type === "list" || active_view.type === "form")